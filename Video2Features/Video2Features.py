@@ -5,8 +5,9 @@
 # 
 # ## Feature extraction from video segment
 # 
-# ### Functions: 4
-# #### RandomVector(), video2frame(), frame2features(), Video2feature()
+# ### Functions: 14, Classes: 1
+# #### projection_file(), RandomVector(), RandomMatrix(), projection_version(), read_projection(), features2vector(), video2frame(), video2frames(), load_frame(), frame2features(), segment2vector(), init_worker(), worker_segment2vector(), Video2feature()
+# #### FrameEmbedder
 # 
 # ### Author: Stelios Karozis
 
@@ -15,24 +16,35 @@
 # In[51]:
 
 
+# Process-wide cache of the projection vectors/matrices, keyed by (file, size)
+projection_cache = {}
+
+
+def projection_file(name='random.pickle'):
+    import os
+    dir_path='../'
+    dirr = os.path.dirname(os.path.realpath(__file__))
+    return os.path.normpath(dirr+'/'+dir_path+name)
+
+
 def RandomVector(trainmode=True,sz=100, debug=False):
     import pickle
     import sys
     import numpy as np
     from numpy import array
     import random
-    dir_path='../'
-    import os 
-    dirr = os.path.dirname(os.path.realpath(__file__))
-    if debug is True: print(dirr)
+    random_vector = projection_file('random.pickle')
+    if debug is True: print(random_vector)
+    key = (random_vector, sz)
+    if key in projection_cache:
+        # loaded (or generated) once per process
+        return projection_cache[key]
     if trainmode==False:
         from pathlib import Path
-        my_file = Path(dirr+'/'+dir_path+'random.pickle')
+        my_file = Path(random_vector)
         if my_file.is_file():
             # file exists
             if debug is True: print('Load random vector')
-            random_vector = dirr+'/'+dir_path+'random.pickle'
-            if debug is True: print(dirr+random_vector)
             vector = pickle.load(open(random_vector, "rb"))
         else:
             print('Error the random vector is missing')
@@ -44,7 +56,113 @@ def RandomVector(trainmode=True,sz=100, debug=False):
             vector.append(tmp)
         with open(random_vector,'wb') as f:
             pickle.dump(array(vector), f)
-    return array(vector)
+    vector = array(vector)
+    vector.setflags(write=False)
+    projection_cache[key] = vector
+    return vector
+
+
+# ## RandomMatrix()
+
+# In[52]:
+
+
+def RandomMatrix(trainmode=True, n_in=25088, sz=100, seed=0, debug=False):
+    '''
+    Random (Gaussian) projection matrix of shape (n_in, sz), used to map the
+    flattened VGG16 features to `sz` dimensions that each carry information.
+    It is generated and saved in train mode and loaded otherwise.
+    '''
+    import pickle
+    import sys
+    import os
+    import numpy as np
+    random_matrix = projection_file('random_matrix.pickle')
+    if debug is True: print(random_matrix)
+    key = (random_matrix, sz)
+    if key in projection_cache:
+        return projection_cache[key]
+    if trainmode==False:
+        if os.path.isfile(random_matrix):
+            if debug is True: print('Load random matrix')
+            matrix = pickle.load(open(random_matrix, "rb"))
+        else:
+            print('Error the random matrix is missing')
+            sys.exit()
+    else:
+        rng = np.random.RandomState(seed)
+        matrix = rng.standard_normal((n_in, sz)).astype('float32') / np.sqrt(sz)
+        with open(random_matrix,'wb') as f:
+            pickle.dump(matrix, f)
+    matrix.setflags(write=False)
+    projection_cache[key] = matrix
+    return matrix
+
+
+# ## projection_version()
+
+# In[54]:
+
+
+def projection_version(projection='vector', trainmode=False):
+    '''
+    Short fingerprint of the projection used for the video features. It is
+    saved next to the features and the model so that mixing vectors between
+    runs can be detected.
+    '''
+    import hashlib
+    import numpy as np
+
+    if isinstance(projection, str) and projection == 'vector':
+        projection = RandomVector(trainmode,sz=100)
+    elif isinstance(projection, str) and projection == 'matrix':
+        projection = RandomMatrix(trainmode, sz=100)
+    data = np.ascontiguousarray(projection)
+    return hashlib.sha1(str(data.dtype).encode() + str(data.shape).encode() + data.tobytes()).hexdigest()[:12]
+
+
+def read_projection(pathIn='./data/'):
+    '''
+    Fingerprint of the projection the saved video features of `pathIn` were
+    extracted with (written by Video2feature next to Video2Features.store);
+    None for features saved before it was recorded.
+    '''
+    import os
+
+    projection_path = pathIn + 'Video2Features.projection'
+    if not os.path.exists(projection_path):
+        return None
+    with open(projection_path) as f:
+        return f.read().strip()
+
+
+# ## features2vector()
+
+# In[53]:
+
+
+def features2vector(features, trainmode=True, projection='vector'):
+    '''
+    Projects the flattened VGG16 features of the frames of one segment
+    (frames x 25088) to a single 100-dim segment vector.
+
+    :param features:    array of per-frame features (or a single frame)
+    :param trainmode:   passed to RandomVector/RandomMatrix
+    :param projection:  'vector' - legacy mean(features) * random vector
+                         (same values as averaging the per-frame outer products),
+                        'matrix' - mean frame projected with RandomMatrix,
+                        or a (25088 x 100) array (e.g. a learned projection)
+    :return:            the segment vector
+    '''
+    import numpy as np
+
+    features = np.atleast_2d(features)
+    if isinstance(projection, str) and projection == 'vector':
+        vector = RandomVector(trainmode,sz=100)
+        return features.mean() * vector
+    if isinstance(projection, str) and projection == 'matrix':
+        projection = RandomMatrix(trainmode, n_in=features.shape[1], sz=100)
+    return np.dot(features.mean(axis=0), projection)
 
 
 # ## video2frame()
@@ -79,41 +197,73 @@ def video2frame(count,sec,folderVID,file,folderIMG):
     # success,a = video2frame(sec,'./',file,'./')
 
 
+# ## video2frames()
+
+# In[31]:
+
+
+def video2frames(filename, frameRate=4, size=(224, 224), folderIMG=None):
+    '''
+    Streaming decoder: opens the video once, walks it sequentially and yields
+    one resized RGB frame every `frameRate` seconds (uint8, size x 3).
+    Frames are only written to disk (as JPG) when `folderIMG` is given (debug).
+    '''
+    import cv2
+    vidcap = cv2.VideoCapture(filename)
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    sec = 0
+    count = 1
+    idx = 0
+    try:
+        while vidcap.grab():
+            if fps > 0:
+                pos = idx / fps
+            else:
+                pos = vidcap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            idx += 1
+            if pos + 1e-6 < sec:
+                continue
+            hasFrames,image = vidcap.retrieve()
+            if not hasFrames:
+                break
+            if folderIMG is not None:
+                cv2.imwrite(folderIMG+str(count)+".jpg", image)     # save frame as JPG file
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            yield cv2.resize(image, size, interpolation=cv2.INTER_NEAREST)
+            count = count + 1
+            sec = sec + frameRate
+            sec = round(sec, 2)
+    finally:
+        vidcap.release()
+
+
+# ## load_frame()
+
+# In[80]:
+
+
+def load_frame(frame):
+    from keras.preprocessing import image
+
+    fr = image.load_img(frame, target_size=(224, 224))
+    return image.img_to_array(fr)
+
+
 # ## frame2features
 
 # In[81]:
 
 
-def frame2features(frame, trainmode=True):
-    import tensorflow as tf
-    from keras.preprocessing import image
-    from keras.applications.vgg16 import VGG16
-    from keras.applications.vgg16 import preprocess_input
-    from keras import backend as K
-    import numpy as np
-    
-    K.clear_session()    
-    #config = tf.compat.v1.ConfigProto() # TF v2.0
-    config = tf.ConfigProto() # TF v1.0
-    config.gpu_options.allow_growth = True
-    sess = tf.Session(config=config)
-    model = VGG16(weights='imagenet', include_top=False)
-    #model.summary()
-
-    fr_path = frame
-    fr = image.load_img(fr_path, target_size=(224, 224))
-    fr_data = image.img_to_array(fr)
-    fr_data = np.expand_dims(fr_data, axis=0)
-    fr_data = preprocess_input(fr_data)
-
-    vgg16_feature = model.predict(fr_data)
-    K.clear_session()
-    vgg16_feature_np = np.array(vgg16_feature)
-    feature = vgg16_feature_np.flatten()
-    tf.reset_default_graph()
-    vector = RandomVector(trainmode,sz=100)
-    return np.dot(feature[:,None],vector[None,:])
-    #return feature 
+def frame2features(frame, trainmode=True, engine=None, projection='vector'):
+
+    # Legacy single-frame path: build a throwaway engine if none is given
+    if engine is None:
+        engine = FrameEmbedder()
+
+    fr_data = load_frame(frame)
+
+    feature = engine.embed([fr_data])[0]
+    return features2vector(feature, trainmode, projection)
 
 # ### test
 
@@ -123,83 +273,345 @@ def frame2features(frame, trainmode=True):
 #frame2features('1.jpg', trainmode=True)
 
 
+# ## FrameEmbedder
+
+# In[82]:
+
+
+class FrameEmbedder(object):
+    '''
+    Long-lived VGG16 embedding engine. The network is built and its weights
+    are loaded once, then reused for every frame of every segment.
+
+    :param intra_op_threads:    TF threads used inside one op (0 = TF default)
+    :param inter_op_threads:    TF threads used across ops (0 = TF default)
+    :param debug:               print model-load time when the engine is created
+    '''
+
+    def __init__(self, intra_op_threads=0, inter_op_threads=0, debug=False):
+        import time
+        import tensorflow as tf
+        from keras.applications.vgg16 import VGG16
+        from keras import backend as K
+
+        t0 = time.perf_counter()
+        K.clear_session()
+        #config = tf.compat.v1.ConfigProto() # TF v2.0
+        config = tf.ConfigProto() # TF v1.0
+        config.gpu_options.allow_growth = True
+        config.intra_op_parallelism_threads = intra_op_threads
+        config.inter_op_parallelism_threads = inter_op_threads
+        self.session = tf.Session(config=config)
+        K.set_session(self.session)
+        self.model = VGG16(weights='imagenet', include_top=False)
+        #model.summary()
+        self.load_time = time.perf_counter() - t0
+        self.inference_time = 0.0
+        self.inference_cpu_time = 0.0
+        self.n_frames = 0
+        if debug is True: print('VGG16 loaded in {0:.2f} s'.format(self.load_time))
+
+    def embed(self, frames):
+        '''
+        Embeds a sequence of 224x224 RGB frames.
+
+        :param frames:  list (or array) of frames, each of shape (224, 224, 3)
+        :return:        array of flattened VGG16 features, one row per frame
+        '''
+        import time
+        import numpy as np
+        from keras.applications.vgg16 import preprocess_input
+
+        fr_data = np.asarray(frames, dtype='float32')
+        fr_data = preprocess_input(fr_data)
+
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        vgg16_feature = self.model.predict(fr_data)
+        self.inference_time += time.perf_counter() - t0
+        self.inference_cpu_time += time.process_time() - c0
+        self.n_frames += fr_data.shape[0]
+
+        return np.asarray(vgg16_feature).reshape(fr_data.shape[0], -1)
+
+    def report(self):
+        '''
+        Prints model-load time separately from inference time.
+        '''
+        print('VGG16 load time: {0:.2f} s, inference time: {1:.2f} s ({2:d} frames)'.format(
+            self.load_time, self.inference_time, self.n_frames))
+
+    def close(self):
+        from keras import backend as K
+        K.clear_session()
+        self.session.close()
+
+
+# ## segment2vector()
+
+# In[84]:
+
+
+def segment2vector(filename, frameRate=4, engine=None, batch_size=32, projection='vector', folderIMG=None):
+    '''
+    Decodes and embeds a whole segment and returns its 100-dim vector
+    and the number of frames used.
+    '''
+    if engine is None:
+        engine = FrameEmbedder()
+
+    ftr_sum, count = None, 0
+    batch = []
+    frames = video2frames(filename, frameRate, folderIMG=folderIMG)
+    while True:
+        fr = next(frames, None)
+        if fr is not None:
+            batch.append(fr)
+        if len(batch) > 0 and (fr is None or len(batch) >= batch_size):
+            feature = engine.embed(batch).sum(axis=0, dtype='float64')
+            ftr_sum = feature if ftr_sum is None else ftr_sum + feature
+            count += len(batch)
+            batch = []
+        if fr is None:
+            break
+
+    if count == 0:
+        raise ValueError('No frames decoded for segment ' + filename)
+    return features2vector(ftr_sum / count, False, projection), count
+
+
+# Embedding engine owned by a pool worker (one per process)
+worker_engine = None
+worker_projection = None
+
+
+def init_worker(intra_op_threads, inter_op_threads, projection):
+    import os
+    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
+    global worker_engine, worker_projection
+    worker_engine = FrameEmbedder(intra_op_threads, inter_op_threads)
+    worker_projection = projection
+
+
+def worker_segment2vector(job):
+    '''
+    Embeds one segment in a pool worker. Returns its vector, its number of
+    frames and the worker-side timings of the segment (wall and CPU time of
+    the whole segment and of the CNN inference alone, the model load time
+    and the worker pid), since the parent process cannot measure them.
+    '''
+    import os
+    import time
+    filename, frameRate, batch_size, folderIMG = job
+    t0, c0 = time.perf_counter(), time.process_time()
+    i0, ic0 = worker_engine.inference_time, worker_engine.inference_cpu_time
+    vector, count = segment2vector(filename, frameRate, worker_engine, batch_size, worker_projection, folderIMG)
+    timings = {
+        'wall': time.perf_counter() - t0,
+        'cpu': time.process_time() - c0,
+        'inference': worker_engine.inference_time - i0,
+        'inference_cpu': worker_engine.inference_cpu_time - ic0,
+        'load': worker_engine.load_time,
+        'pid': os.getpid(),
+    }
+    return vector, count, timings
+
+
 # ## Video2feature()
 
 # In[83]:
 
 
-def Video2feature(pathIn='./data/',frameRate=4, save=True, trainmode=True ):
+def Video2feature(pathIn='./data/',frameRate=4, save=True, trainmode=True, batch_size=32, save_frames=False, projection='vector',
+                  n_jobs=1, intra_op_threads=0, inter_op_threads=0, cache=None):
     import os
     import glob
+    import time
     import numpy as np
     import pandas as pd
     import progressbar
-    import pathlib
+    from helpers import instrumentation as instr
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
     pathIn=pathIn
     index = pd.read_csv(pathIn+'index.csv', sep=';')
 
     frameRate = frameRate #//it will capture image in each 0.5 second -> 2fps
-    ftr_array=[]
 
     print('Extracting features from videos...')
 
-    # [Visuals] Progress bar
-    bar = progressbar.ProgressBar(maxval=index.shape[0], \
-                                  widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
-    bar.start()
-    bar_index = 0
+    # Resolve the projection once (generated in train mode, loaded otherwise);
+    # every segment after that reuses the cached copy
+    version = projection_version(projection, trainmode)
+    trainmode = False
 
+    # Segment files (and frame debug folders) in index.csv order
+    filenames, folders = [], []
     for f,s in index[['FILE','SEG']].values:
-      
-        pathOut=pathIn+'video/'+f+'/frames/'
-        if not os.path.exists(pathOut):
-            os.makedirs(pathOut)
+
+        pathOut=None
+        if save_frames == True:
+            pathOut=pathIn+'video/'+f+'/frames/'
+            if not os.path.exists(pathOut):
+                os.makedirs(pathOut)
      
         files=f+'/'+str(s)   
         # print(pathOut)
         files=glob.glob(pathIn+'video/'+files+'*')[0]
         suffix=os.path.splitext(files)[1]
         files=f+'/'+str(s)+suffix
-        ftr_fr=[]
-        filename=pathIn +'video/'+ files
-        # print(filename)
-        sec = 0
-        count=1
-        success,fr = video2frame(count,sec,pathIn+'video/',files,pathOut)
-        # print(fr)
-        ftr = frame2features(fr,trainmode)
-        ftr_fr.append(ftr)
-
-        while success:
-            count = count + 1
-            sec = sec + frameRate
-            sec = round(sec, 2)
-            success,fr = video2frame(count,sec,pathIn+'video/',files,pathOut)
-            if success == True:
-                # print(fr)
-                ftr = frame2features(fr,trainmode)
-                ftr_fr.append(ftr)
-        ftr_fr = np.vstack(ftr_fr) 
-        ftr_fr = np.average(ftr_fr, axis=0)
-        ftr_array.append(ftr_fr)
-
-        # update progress bar index
-        bar_index += 1
-        bar.update(bar_index)
-
-    bar.finish()
-        
+        filenames.append(pathIn +'video/'+ files)
+        folders.append(pathOut)
+
+    # Segments already in the feature cache (same content and extractor config)
+    ftr_array = [None] * index.shape[0]
+    keys = [None] * index.shape[0]
+    if cache is not None:
+        from helpers.feature_cache import file_hash
+        params = {'extractor': 'vgg16', 'frameRate': frameRate, 'projection': version}
+        for row, filename in enumerate(filenames):
+            keys[row] = cache.key(file_hash(filename), params)
+            ftr_array[row] = cache.get(keys[row])
+    todo = [row for row in range(index.shape[0]) if ftr_array[row] is None]
+
+    def store(row, vector):
+        ftr_array[row] = vector
+        if cache is not None:
+            cache.put(keys[row], vector)
+
+    # [Visuals] Progress bar
+    bar = progressbar.ProgressBar(maxval=index.shape[0], \
+                                  widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
+    bar.start()
+    bar_index = index.shape[0] - len(todo)
+    bar.update(bar_index)
+    t_start = time.perf_counter()
+
+    if len(todo) == 0:
+        bar.finish()
+    elif n_jobs > 1:
+        # Worker-pool mode: each worker owns one embedding model and decodes and
+        # embeds whole segments; imap keeps the results in index.csv order
+        import multiprocessing as mp
+        jobs = [(filenames[row], frameRate, batch_size, folders[row]) for row in todo]
+        n_frames = 0
+        # worker-side timings, summed over the workers (decoding = segment - inference)
+        totals = dict.fromkeys(['wall', 'cpu', 'inference', 'inference_cpu'], 0.0)
+        load_times = {}
+        pool = mp.get_context('spawn').Pool(n_jobs, initializer=init_worker,
+                                            initargs=(intra_op_threads, inter_op_threads, projection))
+        try:
+            for row, (vector, count, timings) in zip(todo, pool.imap(worker_segment2vector, jobs)):
+                store(row, vector)
+                n_frames += count
+                for key in totals:
+                    totals[key] += timings[key]
+                load_times[timings['pid']] = timings['load']
+
+                # update progress bar index
+                bar_index += 1
+                bar.update(bar_index)
+        finally:
+            pool.close()
+            pool.join()
+        bar.finish()
+
+        elapsed = time.perf_counter() - t_start
+        print('Throughput: {0:.1f} frames/sec ({1:d} frames in {2:.1f} s, {3:d} workers)'.format(
+            n_frames / elapsed, n_frames, elapsed, n_jobs))
+        workers = len(load_times)
+        instr.record('cnn model load', max(load_times.values()), workers=workers)
+        instr.record('frame decoding', totals['wall'] - totals['inference'],
+                     totals['cpu'] - totals['inference_cpu'], n_frames, workers)
+        instr.record('cnn inference', totals['inference'], totals['inference_cpu'], n_frames, workers)
+    else:
+        # Load the CNN once and reuse it for every frame of every segment
+        engine = FrameEmbedder(intra_op_threads, inter_op_threads)
+        t_start = time.perf_counter()
+
+        # Frames of one or more segments are gathered into batches; each batch
+        # goes through the network in a single predict call and the per-frame
+        # features are scattered back to the segment (row) they came from.
+        # Only a running sum (25088 values) is kept per open segment; it is
+        # projected to the 100-dim vector once all its frames are embedded.
+        seg_sum, seg_count, seg_pending = {}, {}, {}
+        decoded = set()
+        batch, batch_owner = [], []
+
+        def finalize(row):
+            if seg_count.get(row, 0) == 0:
+                raise ValueError('No frames decoded for segment ' + filenames[row])
+            store(row, features2vector(seg_sum.pop(row) / seg_count.pop(row), trainmode, projection))
+            seg_pending.pop(row, None)
+
+        def flush():
+            for owner, feature in zip(batch_owner, engine.embed(batch)):
+                if owner in seg_sum:
+                    seg_sum[owner] += feature
+                else:
+                    seg_sum[owner] = feature.astype('float64')
+                seg_count[owner] = seg_count.get(owner, 0) + 1
+                seg_pending[owner] -= 1
+                if seg_pending[owner] == 0 and owner in decoded:
+                    finalize(owner)
+            del batch[:], batch_owner[:]
+
+        decode_time, decode_cpu_time = 0.0, 0.0
+        for row in todo:
+            # print(filenames[row])
+            seg_pending[row] = 0
+            frames = video2frames(filenames[row], frameRate, folderIMG=folders[row])
+            while True:
+                t0 = time.perf_counter()
+                c0 = time.process_time()
+                fr = next(frames, None)
+                decode_time += time.perf_counter() - t0
+                decode_cpu_time += time.process_time() - c0
+                if fr is None:
+                    break
+                batch.append(fr)
+                batch_owner.append(row)
+                seg_pending[row] += 1
+                if len(batch) >= batch_size:
+                    flush()
+            decoded.add(row)
+            if seg_pending[row] == 0:
+                finalize(row)
+
+            # update progress bar index
+            bar_index += 1
+            bar.update(bar_index)
+
+        if len(batch) > 0:
+            flush()
+        bar.finish()
+
+        elapsed = time.perf_counter() - t_start
+        print('Throughput: {0:.1f} frames/sec ({1:d} frames in {2:.1f} s, batch size {3:d})'.format(
+            engine.n_frames / elapsed, engine.n_frames, elapsed, batch_size))
+        engine.report()
+        instr.record('cnn model load', engine.load_time)
+        instr.record('frame decoding', decode_time, decode_cpu_time, engine.n_frames)
+        instr.record('cnn inference', engine.inference_time, engine.inference_cpu_time, engine.n_frames)
+        engine.close()
+
+    if cache is not None:
+        cache.report('video')
+        cache.trim()
+
     ftr_array = np.vstack(ftr_array)
 
 
+    # the dataframe index is the segment id (row in index.csv) that merge_features joins on
     ftr_df = pd.DataFrame(data=ftr_array)
     df=index.copy()
     df=pd.concat([df,ftr_df], axis=1)
 
     if save == True:
-        df.to_pickle(pathIn+'Video2Features.pkl')
+        from helpers.feature_store import update_features
+        update_features(df, pathIn+'Video2Features.store')
+        with open(pathIn+'Video2Features.projection', 'w') as f:
+            f.write(version)
 
     return df
 
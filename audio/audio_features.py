@@ -18,6 +18,116 @@ from pyAudioAnalysis import MidTermFeatures as aF
 # import utilities as ut
 
 from . import video_to_audio as v2a
+from .wav_io import read_audio
+from helpers.feature_cache import file_hash, array_hash
+from helpers.feature_store import update_features
+
+
+"""
+Extracts the long-term averaged mid-term feature vector of one segment.
+Module-level so that it can run in a worker process.
+
+ARGUMENTS:
+    job:    (row, file_path, signal, sampling_rate, mt_win, mt_step, st_win, st_step);
+            the WAV file is read when `signal` is None
+
+RETURNS:
+    row, mid_features (None if skipped), mid_feature_names, reason for skipping, process time / duration
+"""
+def segment_features(job):
+    row, file_path, signal, sampling_rate, mt_win, mt_step, st_win, st_step = job
+
+    if signal is None:
+        if not os.path.isfile(file_path):
+            return row, None, [], 'missing file', None
+        if os.stat(file_path).st_size == 0:
+            return row, None, [], 'empty file', None
+        [sampling_rate, signal] = read_audio(file_path)
+    if sampling_rate == 0:
+        return row, None, [], 'no sampling rate', None
+
+    t1 = time.process_time()
+    signal = audioBasicIO.stereo_to_mono(signal)
+    if signal.shape[0] < float(sampling_rate)/5:
+        return row, None, [], 'audio too small', None
+
+    mid_features, _, mid_feature_names = \
+        aF.mid_feature_extraction(signal, sampling_rate,
+                                round(mt_win * sampling_rate),
+                                round(mt_step * sampling_rate),
+                                round(st_win * sampling_rate),
+                                round(st_step * sampling_rate))
+    mid_features = np.transpose(mid_features)
+    mid_features = mid_features.mean(axis=0)
+
+    t2 = time.process_time()
+    duration = float(len(signal)) / sampling_rate
+    return row, mid_features, mid_feature_names, None, (t2 - t1) / duration
+
+
+"""
+Whole-lecture mode: the short-term features are extracted once over the full lecture
+signal and pooled per segment the way the per-file path does.
+
+A segment [start, end] takes the short-term frames of the lecture that start at or after
+`start` and end before `end` (the per-file path frames the segment slice from its own
+first sample, so the two frame grids are less than one short-term step apart). These
+frames are grouped into mid-term windows from the first one on (mid-term mean and
+standard deviation, the last window may be partial) and the windows are averaged, as
+mid_feature_extraction and the long-term averaging of segment_features do. Segments
+shorter than 0.2 s are skipped, as in segment_features.
+
+One difference remains: pyAudioAnalysis normalizes the amplitude (DC and peak) once per
+lecture instead of once per segment. Its effect on the features is measured by
+benchmarks/lecture_audio_features.py; models trained on per-file features are not used
+with these features (see classification.load_model, `audio_mode`).
+
+pyAudioAnalysis converts the whole lecture to float64 first, so the peak memory is a
+few float64 copies of the lecture even when `signal` is memory-mapped.
+
+ARGUMENTS:
+    signal, sampling_rate:  the full lecture signal
+    segments:               segments of the form [[a0, b0], [a1, b1], ...] (in seconds)
+    mt_win, mt_step:        mid-term window length and step (in seconds)
+    st_win, st_step:        short-term window and step (in seconds)
+
+RETURNS:
+    features:               (segments x features) matrix, NaN rows for segments without frames
+    feature_names:
+"""
+def lecture_features(signal, sampling_rate, segments, mt_win=1.0, mt_step=1.0, st_win=0.050, st_step=0.050):
+    signal = audioBasicIO.stereo_to_mono(signal)
+    mid_window, mid_step = round(mt_win * sampling_rate), round(mt_step * sampling_rate)
+    short_window, short_step = round(st_win * sampling_rate), round(st_step * sampling_rate)
+    # only the short-term features of the lecture are used
+    _, short_features, mid_feature_names = \
+        aF.mid_feature_extraction(signal, sampling_rate, mid_window, mid_step, short_window, short_step)
+    short_features = np.asarray(short_features)
+
+    # mid-term windows in short-term frames (as mid_feature_extraction)
+    mid_window_ratio = int(round(mid_window / short_step))
+    mid_step_ratio = int(round(mid_step / short_step))
+
+    features = np.full((len(segments), 2 * short_features.shape[0]), np.nan)
+    for row, (start, end) in enumerate(segments):
+        # samples of the segment slice (as av_segmentation.slice_segments)
+        first_sample, last_sample = int(round(start * sampling_rate)), int(round(end * sampling_rate))
+        if last_sample - first_sample < float(sampling_rate) / 5:
+            continue
+        first = -(-first_sample // short_step)
+        last = min((last_sample - short_window) // short_step + 1, short_features.shape[1])
+        if last <= first:
+            continue
+
+        frames = short_features[:, first:last]
+        mid_features = []
+        for position in range(0, frames.shape[1], mid_step_ratio):
+            window = frames[:, position:position + mid_window_ratio]
+            mid_features.append(np.concatenate((window.mean(axis=1), window.std(axis=1))))
+        # long term averaging of mid-term statistics
+        features[row] = np.nan_to_num(np.array(mid_features)).mean(axis=0)
+
+    return features, mid_feature_names
 
 
 """
@@ -33,6 +143,17 @@ ARGUMENTS:
     dir_name:           Directory that contains the audio files
     mt_win, mt_step:    mid-term window length and step (in seconds)
     st_win, st_step:    short-term window and step (in seconds)
+    signals:            (optional) per-segment signals in index CSV order, already decoded
+                        (e.g. sliced from the lecture by av_segmentation.input2seg); no WAV is
+                        extracted or read in that case
+    fs:                 sampling rate of `signals`
+    cache:              (optional) helpers.feature_cache.FeatureCache; segments whose content and
+                        parameters are already cached are not extracted again
+    n_jobs:             number of worker processes (1: extract in this process); results are
+                        collected in index CSV order
+    lecture:            (optional) (signal, segments) of the full lecture, with `segments` in index
+                        CSV order; features are then extracted once over the lecture and pooled per
+                        segment (see lecture_features)
 
 RETURNS:
     features:
@@ -40,93 +161,170 @@ RETURNS:
     file_names:
     
 """
-def audio_features_extraction(dir_name="../data", mt_win=1.0, mt_step=1.0, st_win=0.050, st_step=0.050, features_audio_file='Audio2Features.pkl'):
+def audio_features_extraction(dir_name="../data", mt_win=1.0, mt_step=1.0, st_win=0.050, st_step=0.050, features_audio_file='Audio2Features.store',
+                              signals=None, fs=None, cache=None, n_jobs=1, lecture=None):
 
     audio_dir = dir_name + '/'+ 'audio'
 
-    # first, extract audio from video
-    v2a.video2audio(dir_name)
-
-    features = []
-    file_names = []
+    # first, extract audio from video (not needed if the signals are given);
+    # the segments whose transcode failed are reported as invalid rows below
+    failed = set()
+    if signals is None and lecture is None:
+        for video, returncode in v2a.video2audio(dir_name):
+            failed.add((os.path.basename(os.path.dirname(video)), os.path.splitext(os.path.basename(video))[0]))
 
-    mid_term_features = np.array([])
     process_times = []
 
     # type is WAVE file, convert using the function video_to_audio.py
     suffix = ".wav"
     index_df = pd.read_csv(dir_name+'/'+'index.csv', sep=';')
 
-    wav_file_list, mid_feature_names = [], []
+    # Preallocated feature matrix (one row per index row, allocated once the
+    # feature dimension is known) and per-row validity mask; rows keep their
+    # index position, so invalid segments are reported instead of shifting
+    # the features of the following ones
+    n_rows = len(index_df)
+    mid_term_features = None
+    valid = np.zeros(n_rows, dtype=bool)
+    invalid = []
+
+    wav_file_list, mid_feature_names = [None] * n_rows, []
 
     # iterate each audio file
     print('Extracting features from audio files...')
 
-    bar = progressbar.ProgressBar(maxval=len(index_df), \
+    bar = progressbar.ProgressBar(maxval=n_rows, \
                                   widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
     bar.start()
     bar_index = 0
-    for ind in index_df.index:
-        name = index_df['FILE'][ind]
-        seg = str(index_df['SEG'][ind])
-
-        file_path = audio_dir + '/' + name + '/' + seg + suffix
-        # print("Analyzing file {0:d} of {1:d}: {2:s}".format(ind+1,len(index_df),file_path))
 
-        if os.stat(file_path).st_size == 0:
-            logging.warning("WARNING: EMPTY FILE -- SKIPPING")
-            continue
-        [sampling_rate, signal] = audioBasicIO.read_audio_file(file_path)
-        if sampling_rate == 0:
-            logging.warning("WARNING: NO SAMPLING RATE -- SKIPPING")
-            continue
-
-        t1 = time.clock()
-        signal = audioBasicIO.stereo_to_mono(signal)
-        if signal.shape[0] < float(sampling_rate)/5:
-            logging.warning("WARNING: AUDIO FILE TOO SMALL -- SKIPPING")
-            continue
-        wav_file_list.append(file_path)
-
-        mid_features, _, mid_feature_names = \
-            aF.mid_feature_extraction(signal, sampling_rate,
-                                    round(mt_win * sampling_rate),
-                                    round(mt_step * sampling_rate),
-                                    round(st_win * sampling_rate),
-                                    round(st_step * sampling_rate))
-        mid_features = np.transpose(mid_features)
-        mid_features = mid_features.mean(axis=0)
+    def accept(row, mid_features):
+        nonlocal mid_term_features
+        if mid_term_features is None:
+            mid_term_features = np.full((n_rows, mid_features.shape[0]), np.nan)
         # long term averaging of mid-term statistics
-        if (not np.isnan(mid_features).any()) and \
-                (not np.isinf(mid_features).any()):
-            if len(mid_term_features) == 0:
-                # append feature vector
-                mid_term_features = mid_features
+        if np.isfinite(mid_features).all():
+            mid_term_features[row] = mid_features
+            valid[row] = True
+        else:
+            invalid.append((row, 'NaN/Inf features'))
+
+    # whole-lecture mode: one extraction over the lecture, pooled per segment
+    jobs, keys = [], [None] * n_rows
+    if lecture is not None:
+        lecture_signal, segments = lecture
+        if len(segments) != n_rows:
+            raise ValueError('Expected ' + str(n_rows) + ' lecture segments, got ' + str(len(segments)))
+        t1 = time.process_time()
+        lecture_ftr, mid_feature_names = lecture_features(lecture_signal, fs, segments, mt_win, mt_step, st_win, st_step)
+        t2 = time.process_time()
+        process_times.append((t2 - t1) / (float(len(lecture_signal)) / fs))
+        for row in range(n_rows):
+            if np.isnan(lecture_ftr[row]).all():
+                invalid.append((row, 'no mid-term frame'))
             else:
-                mid_term_features = np.vstack((mid_term_features,mid_features))
-
-        t2 = time.clock()
-        duration = float(len(signal)) / sampling_rate
-        process_times.append((t2 - t1) / duration)
-
-        # update progress bar index
-        bar_index += 1
+                accept(row, lecture_ftr[row])
+        bar_index = n_rows
         bar.update(bar_index)
+    else:
+        # cached segments are taken as is, the others become extraction jobs
+        for row, ind in enumerate(index_df.index):
+            name = index_df['FILE'][ind]
+            seg = str(index_df['SEG'][ind])
+
+            file_path = audio_dir + '/' + name + '/' + seg + suffix
+            # print("Analyzing file {0:d} of {1:d}: {2:s}".format(ind+1,len(index_df),file_path))
+            wav_file_list[row] = file_path
+            signal = signals[row] if signals is not None else None
+
+            # a failed transcode leaves no WAV behind: skip the segment (not the extraction)
+            if signal is None and ((name, seg) in failed or not os.path.isfile(file_path)
+                                   or os.path.getsize(file_path) == 0):
+                invalid.append((row, 'transcode failed' if (name, seg) in failed else 'missing or empty WAV'))
+                bar_index += 1
+                bar.update(bar_index)
+                continue
+
+            if cache is not None:
+                source_hash = array_hash(signal) if signal is not None else file_hash(file_path)
+                keys[row] = cache.key(source_hash, {'extractor': 'pyAudioAnalysis', 'fs': fs,
+                                                    'mt_win': mt_win, 'mt_step': mt_step,
+                                                    'st_win': st_win, 'st_step': st_step})
+                mid_features = cache.get(keys[row])
+                if mid_features is not None:
+                    accept(row, mid_features)
+                    bar_index += 1
+                    bar.update(bar_index)
+                    continue
+
+            jobs.append((row, file_path, signal, fs, mt_win, mt_step, st_win, st_step))
+
+    t_start = time.perf_counter()
+    pool = None
+    if n_jobs > 1 and len(jobs) > 1:
+        # many short (~20 s) segments: send them in chunks (about 4 per worker)
+        # so that the IPC round trips do not dominate
+        import multiprocessing as mp
+        chunksize = max(1, len(jobs) // (4 * n_jobs))
+        pool = mp.get_context('spawn').Pool(n_jobs)
+        results = pool.imap(segment_features, jobs, chunksize)
+    else:
+        results = map(segment_features, jobs)
+
+    try:
+        for row, mid_features, names, reason, process_time in results:
+            if mid_features is None:
+                invalid.append((row, reason))
+            else:
+                if len(names) > 0:
+                    mid_feature_names = names
+                if cache is not None:
+                    cache.put(keys[row], mid_features)
+                accept(row, mid_features)
+                process_times.append(process_time)
+
+            # update progress bar index
+            bar_index += 1
+            bar.update(bar_index)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     bar.finish()
+    elapsed = time.perf_counter() - t_start
 
     if len(process_times) > 0:
         print("Audio feature extraction completed. Complexity ratio: "
                 "{0:.1f} x realtime".format((1.0 /
                                             np.mean(np.array(process_times)))))
-
-    print('Shape: ' + str(mid_term_features.shape))
-
-    ftr_df = pd.DataFrame(data=mid_term_features)
-    df=index_df.copy()
+        if pool is not None:
+            print("Aggregated over {0:d} workers: {1:.1f} segments/sec ({2:.1f} s wall)".format(
+                n_jobs, len(jobs) / elapsed, elapsed))
+
+    if cache is not None:
+        cache.report('audio')
+        cache.trim()
+
+    # report the invalid segments (they are left out of the features dataframe)
+    for row, reason in sorted(invalid):
+        logging.warning("WARNING: SEGMENT SKIPPED ({0:s}): {1:s}/{2:s}".format(
+            reason, index_df['FILE'].iloc[row], str(index_df['SEG'].iloc[row])))
+
+    if mid_term_features is None:
+        mid_term_features = np.empty((n_rows, 0))
+    mid_term_features = mid_term_features[valid]
+    wav_file_list = [wav_file_list[row] for row in np.flatnonzero(valid)]
+
+    print('Shape: ' + str(mid_term_features.shape) + ', skipped segments: ' + str(len(invalid)))
+
+    # features are aligned on the index rows they were extracted from: the dataframe index
+    # is the segment id (row in index.csv) that helpers.merge_features joins on
+    ftr_df = pd.DataFrame(data=mid_term_features, index=index_df.index[valid])
+    df=index_df[valid].copy()
     df=pd.concat([df,ftr_df], axis=1)
     if True:
-        df.to_pickle(dir_name + '/' + features_audio_file)
+        update_features(df, dir_name + '/' + features_audio_file)
 
     return mid_term_features, wav_file_list, mid_feature_names
 
@@ -5,6 +5,8 @@ convert video files to mono-audio wavs
 import os
 import glob
 import sys
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
 logging.basicConfig(level=logging.DEBUG)
 
@@ -18,52 +20,112 @@ def main(argv):
 
 
 
-def video2audio(data_path='../data'):
+def is_up_to_date(input_path, output_path):
+    '''
+    An output WAV is up to date if it is not empty and newer than its video.
+    '''
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return False
+    return os.path.getmtime(output_path) >= os.path.getmtime(input_path)
+
+
+def transcode(input_path, output_path, sampling_rate="16000", channels="1"):
+    '''
+    Runs one ffmpeg transcode (video -> mono wav) and returns its exit code.
+    A failed transcode does not leave a (possibly empty) WAV behind.
+    '''
+    # ffmpeg -i video/videoplayback.mp4 -ar 16000 -ac 1 out.w
+    ffmpeg_command = ['ffmpeg', '-y', '-i', input_path, '-ar', sampling_rate, '-ac', channels, output_path, '-loglevel', 'quiet']
+    try:
+        returncode = subprocess.call(ffmpeg_command, stdin=subprocess.DEVNULL)
+    except OSError:
+        returncode = -1
+    if returncode != 0 and os.path.exists(output_path):
+        os.remove(output_path)
+    return returncode
+
+
+def decode_audio(input_path, sampling_rate="16000", channels="1"):
+    '''
+    Decodes the audio of a video (or audio) file in memory, through an ffmpeg
+    pipe: no WAV is written.
+
+    :return: sampling rate, signal (int16 samples; empty if decoding failed)
+    '''
+    import numpy as np
+    ffmpeg_command = ['ffmpeg', '-i', input_path, '-f', 's16le', '-ar', sampling_rate, '-ac', channels,
+                      '-loglevel', 'quiet', 'pipe:1']
+    result = subprocess.run(ffmpeg_command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE)
+    return int(sampling_rate), np.frombuffer(result.stdout, dtype=np.int16)
+
+
+def video2audio(data_path='../data', n_jobs=None):
+    '''
+    Extracts a mono 16 kHz WAV for every video part in `data_path`/video/*.
+    Up to `n_jobs` ffmpeg transcodes run at once (default: one per core) and
+    files whose WAV is already up to date are skipped.
+
+    :return: list of (video, exit code) for the failed transcodes
+    '''
 
     # Init vars
     sampling_rate = "16000"
     channels = "1"
     input_dir = data_path + "/video"
     output_dir = data_path + "/audio"
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
 
     class_dirs = [d for d in os.listdir(input_dir) if os.path.isdir(os.path.join(input_dir, d))]
 
+    # collect the out-of-date (video, wav) pairs of every class directory
+    jobs = []
     for d in class_dirs:
         # class directory paths
         input_class_path = input_dir + '/' + d
         output_class_path = output_dir + '/' + d
 
-        # skip if class directory already exists
-        if os.path.exists(output_class_path):
-            continue
-
         # create class directory
-        os.makedirs(output_class_path)
-
-        video_files = cW.getVideoFilesFromFolder(input_class_path)
+        os.makedirs(output_class_path, exist_ok=True)
 
-        print('Extracting audio file in folder: "' + d + '" ...')
-
-        bar = progressbar.ProgressBar(maxval=len(video_files), \
-                                      widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
-        bar.start()
-        bar_index = 0
-        for f in video_files:
-            class_dir = os.path.basename(os.path.dirname(f))
+        for f in cW.getVideoFilesFromFolder(input_class_path):
             f_name = os.path.basename(f)
             output_name = os.path.splitext(f_name)[0]
+            output_path = output_class_path + '/' + output_name + '.wav'
+
+            # skip if the wav of this part is already up to date
+            if not is_up_to_date(f, output_path):
+                jobs.append((f, output_path))
 
-            # ffmpeg -i video/videoplayback.mp4 -ar 16000 -ac 1 out.w
-            ffmpeg_command = 'ffmpeg -i ' + f + ' -ar ' + sampling_rate + ' -ac ' + channels + ' ' + output_dir + '/' + class_dir + '/' + output_name + '.wav' + ' -loglevel quiet'
-            os.system(ffmpeg_command)
+    if len(jobs) == 0:
+        return []
+
+    print('Extracting audio from ' + str(len(jobs)) + ' video files (' + str(n_jobs) + ' parallel jobs) ...')
+
+    bar = progressbar.ProgressBar(maxval=len(jobs), \
+                                  widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
+    bar.start()
+    bar_index = 0
+    failures = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(transcode, f, output_path, sampling_rate, channels): f for f, output_path in jobs}
+        for future in as_completed(futures):
+            returncode = future.result()
+            if returncode != 0:
+                failures.append((futures[future], returncode))
 
             # update progress bar index
             bar_index+=1
             bar.update(bar_index)
 
-        bar.finish()
+    bar.finish()
+
+    for f, returncode in sorted(failures):
+        logging.error('ffmpeg failed (exit code ' + str(returncode) + '): ' + f)
+
+    print('Audio extraction completed (.mp4 -> .wav): ' + str(len(jobs) - len(failures)) + ' ok, ' + str(len(failures)) + ' failed.')
 
-        print('Audio extraction completed (.mp4 -> .wav).')
+    return failures
 
 
 
@@ -0,0 +1,111 @@
+"""
+memory-mapped WAV access
+"""
+
+import os
+import time
+from scipy.io import wavfile
+
+from pyAudioAnalysis import audioBasicIO
+
+
+"""
+Opens a PCM WAV file as a read-only `np.memmap` (no decode, no copy): samples are only
+paged in when they are used. Slices of the returned signal (e.g. per-segment parts) are
+views. This only holds up to the first consumer that converts the whole signal: the
+pyAudioAnalysis feature extraction (silenceRemoval, mid_feature_extraction) and
+stereo_to_mono copy it to float64 (8 bytes per sample); per-segment slices stay small,
+but a whole track handed to them still peaks at a few float64 copies of it (see
+av_segmentation.segment_audio `low_memory` and benchmarks/segmentation_memory.py).
+
+ARGUMENTS:
+    path:               the WAV file
+
+RETURNS:
+    sampling_rate, signal (samples, or samples x channels)
+"""
+def read_wav_memmap(path):
+    sampling_rate, signal = wavfile.read(path, mmap=True)
+    return sampling_rate, signal
+
+
+"""
+Reads an audio file, memory-mapping it when it is a WAV file that can be mapped
+(PCM or float samples) and falling back to audioBasicIO.read_audio_file otherwise.
+
+ARGUMENTS:
+    path:               the audio file
+
+RETURNS:
+    sampling_rate, signal
+"""
+def read_audio(path):
+    if os.path.splitext(path)[1].lower() == '.wav':
+        try:
+            return read_wav_memmap(path)
+        except ValueError:
+            # e.g. 24-bit samples cannot be mapped
+            pass
+    return audioBasicIO.read_audio_file(path)
+
+
+"""
+Reads `size` bytes from a stream; with `follow` (a file that is still being written) the
+read is retried until the bytes are there or the file stops growing for `idle_timeout`.
+
+ARGUMENTS:
+    f:                  the file, opened in binary mode
+    size:               the number of bytes
+    follow:             wait for the bytes that are not written yet
+    poll:               waiting time between reads (in seconds)
+    idle_timeout:       give up after this long without new bytes (in seconds)
+
+RETURNS:
+    the bytes read (fewer than `size` at the end of the stream)
+"""
+def read_exactly(f, size, follow=False, poll=0.5, idle_timeout=10.0):
+    data = f.read(size)
+    idle = 0.0
+    while follow and len(data) < size and idle < idle_timeout:
+        more = f.read(size - len(data))
+        if more:
+            data += more
+            idle = 0.0
+        else:
+            time.sleep(poll)
+            idle += poll
+    return data
+
+
+"""
+Skips the header of a WAV stream (RIFF chunks up to the `data` chunk), so that the
+following reads return raw samples. Used on files that are still being written, whose
+header sizes are not final yet: with `follow`, an empty file or an incomplete header is
+waited for (polling) until the whole header up to the `data` chunk has been written.
+
+ARGUMENTS:
+    f:                  the WAV file, opened in binary mode
+    follow:             the file is still being written
+    poll:               waiting time between reads of a growing file (in seconds)
+    idle_timeout:       a file whose header has not grown for this long is not a WAV stream (in seconds)
+
+RETURNS:
+    the number of header bytes skipped
+"""
+def skip_wav_header(f, follow=False, poll=0.5, idle_timeout=10.0):
+    header = read_exactly(f, 12, follow, poll, idle_timeout)
+    if len(header) < 12 or header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise ValueError('not a WAV stream')
+    skipped = 12
+    while True:
+        chunk = read_exactly(f, 8, follow, poll, idle_timeout)
+        if len(chunk) < 8:
+            raise ValueError('WAV stream without a data chunk')
+        skipped += 8
+        if chunk[:4] == b'data':
+            return skipped
+        size = int.from_bytes(chunk[4:8], 'little')
+        size += size % 2  # chunks are word aligned
+        if len(read_exactly(f, size, follow, poll, idle_timeout)) < size:
+            raise ValueError('WAV stream without a data chunk')
+        skipped += size
@@ -0,0 +1,97 @@
+"""
+Feature store vs dataframe pickles: load time and peak RSS.
+
+Converts the feature pickles of a data folder (optionally replicated to a
+larger number of rows) to feature stores, then loads each of them in a fresh
+process: the full pickle (pd.read_pickle), the full store, the memory-mapped
+feature block only, and a column subset (audio only for the merged features).
+
+    python benchmarks/feature_store.py data --scale 100
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from helpers.feature_store import FeatureStore, write_features
+from helpers.helpers import modality_columns
+from helpers.instrumentation import peak_rss_mb
+
+
+def peak_rss():
+    # high-water mark of this process (ru_maxrss would include the parent's, inherited across exec)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return peak_rss_mb('self')
+
+
+def load(kind, path, columns=None):
+    # runs in a fresh process: reports the load time and the peak RSS it reached
+    rss = peak_rss()
+    t0 = time.perf_counter()
+    if kind == 'pickle':
+        data = pd.read_pickle(path)
+    elif kind == 'store':
+        data = FeatureStore(path).read(columns)
+    else:
+        data = FeatureStore(path).matrix(columns)
+        data.sum()  # touch the mapped pages
+    print(json.dumps({'load_s': time.perf_counter() - t0, 'peak_rss_mb': peak_rss(), 'load_rss_mb': peak_rss() - rss}))
+
+
+def measure(kind, path, columns=None):
+    command = [sys.executable, os.path.realpath(__file__), '--load', kind, path]
+    if columns is not None:
+        command += ['--columns', columns]
+    return json.loads(subprocess.check_output(command).decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Feature store benchmark')
+    parser.add_argument('data_dir', nargs='?', default='data', help='folder with the feature pickles')
+    parser.add_argument('--scale', type=int, default=1, help='replicate the rows this many times')
+    parser.add_argument('--load', nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument('--columns', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load is not None:
+        load(args.load[0], args.load[1], args.columns)
+        return
+
+    work_dir = tempfile.mkdtemp()
+    video_df = pd.read_pickle(os.path.join(args.data_dir, 'Video2Features.pkl'))
+    audio_df = pd.read_pickle(os.path.join(args.data_dir, 'Audio2Features.pkl'))
+    for name in ('Video2Features', 'Audio2Features', 'Features'):
+        df = pd.read_pickle(os.path.join(args.data_dir, name + '.pkl'))
+        df = pd.concat([df] * args.scale, ignore_index=True)
+        pickle_path = os.path.join(work_dir, name + '.pkl')
+        store_path = os.path.join(work_dir, name + '.store')
+        df.to_pickle(pickle_path)
+        modalities = modality_columns(video_df, audio_df) if name == 'Features' else None
+        write_features(df, store_path, modalities=modalities)
+
+        print('{0} ({1:d} x {2:d})'.format(name, df.shape[0], df.shape[1]))
+        runs = [('pickle', pickle_path, None), ('store', store_path, None), ('memmap', store_path, None)]
+        if modalities is not None:
+            runs += [('store', store_path, 'audio'), ('memmap', store_path, 'audio')]
+        for kind, path, columns in runs:
+            result = measure(kind, path, columns)
+            print('  {0:8s} {1:6s} load {2:8.1f} ms  peak RSS {3:8.1f} MB (+{4:.1f} MB by the load)'.format(
+                kind, columns or 'all', result['load_s'] * 1000, result['peak_rss_mb'], result['load_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
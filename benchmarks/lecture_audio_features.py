@@ -0,0 +1,75 @@
+"""
+Whole-lecture vs per-segment audio feature extraction.
+
+Segments a lecture WAV with segment_audio, extracts the per-segment vectors
+both ways (one mid_feature_extraction per segment, and lecture_features over
+the full signal) and reports the run time of each path and how close the
+vectors are. The gap is measured twice: on the segments as cut (short-term
+frame grids up to one step apart, and the amplitude normalized per lecture
+instead of per segment) and on the segments with their starts snapped to the
+short-term grid of the lecture, where only the normalization differs.
+
+    python benchmarks/lecture_audio_features.py data/target_1m/audio/input.mp4.wav
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+from audio.wav_io import read_audio
+import audio.audio_features as af
+import helpers.av_segmentation as seg
+
+
+def per_segment_features(x, fs, segments):
+    per_segment = []
+    for row, signal in enumerate(seg.slice_segments(x, fs, segments)):
+        _, features, _, _, _ = af.segment_features((row, None, signal, fs, 1.0, 1.0, 0.050, 0.050))
+        per_segment.append(features)
+    # segments too short for the per-file path are left out of the comparison (NaN)
+    n_features = max(len(features) for features in per_segment if features is not None)
+    return np.vstack([features if features is not None else np.full(n_features, np.nan) for features in per_segment])
+
+
+def report_gap(name, lecture, per_segment):
+    # relative difference of every feature, scaled by its mean magnitude over the segments
+    scale = np.nanmean(np.abs(per_segment), axis=0) + 1e-10
+    rel = np.abs(lecture - per_segment) / scale
+    worst = np.nanmax(rel, axis=0)
+    print('{0:s}: relative difference median {1:.4f}, 95th percentile {2:.4f}, max {3:.4f} (feature {4:d})'.format(
+        name, np.nanmedian(rel), np.nanpercentile(rel, 95), np.nanmax(worst), int(np.nanargmax(worst))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Whole-lecture audio features benchmark')
+    parser.add_argument('wav', help='lecture WAV file')
+    args = parser.parse_args()
+
+    fs, x = read_audio(args.wav)
+    segments = seg.segment_audio(os.path.basename(args.wav), fs=fs, x=x)
+
+    t0 = time.perf_counter()
+    per_segment = per_segment_features(x, fs, segments)
+    t_segment = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    lecture, _ = af.lecture_features(x, fs, segments)
+    t_lecture = time.perf_counter() - t0
+
+    print('segments: {0:d}'.format(len(segments)))
+    print('per-segment: {0:.2f} s, whole-lecture: {1:.2f} s'.format(t_segment, t_lecture))
+    report_gap('segments as cut', lecture, per_segment)
+
+    # starts on the short-term grid of the lecture: the frames are the same, only the normalization differs
+    step = 0.050
+    snapped = [[round(start / step) * step, end] for start, end in segments]
+    report_gap('normalization only', af.lecture_features(x, fs, snapped)[0], per_segment_features(x, fs, snapped))
+
+
+if __name__ == '__main__':
+    main()
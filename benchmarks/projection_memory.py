@@ -0,0 +1,72 @@
+"""
+Peak-RSS benchmark of the video segment projection.
+
+Compares the legacy path (one 25088x100 outer product per frame, vstacked and
+averaged per segment) with features2vector on synthetic VGG16 features.
+Each method runs in a fresh interpreter so that ru_maxrss is not shared.
+
+    python benchmarks/projection_memory.py --frames 5 --segments 20
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+n_features = 25088
+sz = 100
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def run(method, frames, segments):
+    rng = np.random.RandomState(0)
+    vector = rng.uniform(0.5, 1.0, sz)
+    matrix = rng.standard_normal((n_features, sz)).astype('float32') / np.sqrt(sz)
+    base = peak_rss_mb()
+
+    t0 = time.perf_counter()
+    out = []
+    for _ in range(segments):
+        features = rng.rand(frames, n_features).astype('float32')
+        if method == 'legacy':
+            ftr_fr = [np.dot(feature[:, None], vector[None, :]) for feature in features]
+            ftr_fr = np.vstack(ftr_fr)
+            out.append(np.average(ftr_fr, axis=0))
+        elif method == 'vector':
+            out.append(features.mean() * vector)
+        else:
+            out.append(np.dot(features.mean(axis=0), matrix))
+    elapsed = time.perf_counter() - t0
+
+    print('{0:8s} peak RSS: {1:8.1f} MB (+{2:.1f} MB), {3:.3f} s'.format(
+        method, peak_rss_mb(), peak_rss_mb() - base, elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Projection peak-RSS benchmark')
+    parser.add_argument('--frames', type=int, default=5, help='frames per segment')
+    parser.add_argument('--segments', type=int, default=20)
+    parser.add_argument('--method', choices=['legacy', 'vector', 'matrix'], default=None)
+    args = parser.parse_args()
+
+    if args.method is not None:
+        run(args.method, args.frames, args.segments)
+        return
+
+    for method in ['legacy', 'vector', 'matrix']:
+        subprocess.call([sys.executable, os.path.realpath(__file__), '--method', method,
+                         '--frames', str(args.frames), '--segments', str(args.segments)])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Single-segment scoring latency of LectureScorer.
+
+Loads the model once, then scores one segment (e.g. a 20 s part) repeatedly,
+from its video file (decode + features + prediction) and from frames and
+audio already in memory (features + prediction), and reports the p50/p99
+latency of each path.
+
+    python benchmarks/scorer_latency.py data/target_5m/video/input/part_0.mp4 --data_dir data --n 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import Video2Features.Video2Features as vf
+from audio.video_to_audio import decode_audio
+from classification.scorer import LectureScorer
+
+
+def latency(score, n):
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        score()
+        times.append(time.perf_counter() - t0)
+    return np.percentile(times, 50) * 1000, np.percentile(times, 99) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Single-segment scoring latency benchmark')
+    parser.add_argument('segment', help='segment video file (e.g. a 20 s part)')
+    parser.add_argument('--data_dir', default='data', help='directory of the trained model')
+    parser.add_argument('--n', type=int, default=50, help='number of scoring calls')
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    scorer = LectureScorer(data_dir=args.data_dir)
+    print('scorer loaded and warmed up in {0:.2f} s'.format(time.perf_counter() - t0))
+
+    frames = np.asarray(list(vf.video2frames(args.segment, scorer.frame_rate)))
+    fs, signal = decode_audio(args.segment)
+    print('segment: {0:.1f} s, {1:d} frames'.format(len(signal) / float(fs), len(frames)))
+    print('label: {0}, scores: {1}'.format(*scorer.score(args.segment)))
+
+    p50, p99 = latency(lambda: scorer.score(args.segment), args.n)
+    print('from file:   p50 {0:.1f} ms, p99 {1:.1f} ms'.format(p50, p99))
+    p50, p99 = latency(lambda: scorer.score(frames=frames, signal=signal, fs=fs), args.n)
+    print('from arrays: p50 {0:.1f} ms, p99 {1:.1f} ms'.format(p50, p99))
+    print('last call: ' + ', '.join('{0} {1:.1f} ms'.format(k, v * 1000) for k, v in scorer.timings.items()))
+
+    scorer.close()
+
+
+if __name__ == '__main__':
+    main()
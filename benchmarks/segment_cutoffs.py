@@ -0,0 +1,76 @@
+"""
+Cutoff selection in segment_audio: linear pass vs the previous list comprehension.
+
+Builds synthetic cutoff lists (silence points every 0.5-15 s) and times
+cutoffs2segments on 10^5 cutoffs; on a smaller list it also times the previous
+algorithm (which rescanned all the cutoffs for every segment) and checks that
+both return the same segments. The expected segments themselves are checked in
+tests/test_segmentation.py.
+
+    python benchmarks/segment_cutoffs.py --n 100000 --n_legacy 5000
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import helpers.av_segmentation as seg
+
+
+def legacy_cutoffs2segments(cutoffs, audio_duration, up_bound=20):
+    # the selection previously inlined in segment_audio (quadratic; loops forever
+    # if two consecutive cutoffs are `up_bound` or more apart)
+    seg_num = len(cutoffs)
+    cutoffs = [0.0] + list(cutoffs)
+    segments = []
+    running_idx = 0
+    while True:
+        start_point = 0.0 if running_idx == 0 else cutoffs[running_idx]
+        durations = [c for c in cutoffs if 0 <= c - start_point < up_bound]
+        running_idx += len(durations) - 1
+        if running_idx == seg_num:
+            break
+        segments.append([start_point, durations[-1]])
+    if audio_duration - segments[-1][1] < 6:
+        segments[-1][1] = audio_duration
+    else:
+        segments.append([segments[-1][1], audio_duration])
+    return segments
+
+
+def synthetic_cutoffs(n, seed=0):
+    rng = np.random.RandomState(seed)
+    cutoffs = np.cumsum(rng.uniform(0.5, 15, n))
+    return cutoffs, float(cutoffs[-1] + 3.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segment cutoff selection benchmark')
+    parser.add_argument('--n', type=int, default=100000, help='number of cutoffs')
+    parser.add_argument('--n_legacy', type=int, default=5000, help='number of cutoffs for the legacy comparison')
+    args = parser.parse_args()
+
+    cutoffs, duration = synthetic_cutoffs(args.n)
+    t0 = time.perf_counter()
+    segments = seg.cutoffs2segments(cutoffs, duration)
+    print('{0:d} cutoffs -> {1:d} segments: {2:.3f} s'.format(args.n, len(segments), time.perf_counter() - t0))
+
+    cutoffs, duration = synthetic_cutoffs(args.n_legacy, seed=1)
+    t0 = time.perf_counter()
+    segments = seg.cutoffs2segments(cutoffs, duration)
+    t_new = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    legacy = legacy_cutoffs2segments(list(cutoffs), duration)
+    t_legacy = time.perf_counter() - t0
+    same = len(segments) == len(legacy) and np.allclose(np.array(segments), np.array(legacy))
+    print('{0:d} cutoffs: linear {1:.3f} s, legacy {2:.3f} s, same segments: {3}'.format(
+        args.n_legacy, t_new, t_legacy, same))
+
+
+if __name__ == '__main__':
+    main()
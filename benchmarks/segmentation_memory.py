@@ -0,0 +1,94 @@
+"""
+Peak-RSS benchmark of the lecture silence detection.
+
+Writes a synthetic 16 kHz 16-bit mono WAV (speech-like bursts separated by
+pauses) and segments it with segment_audio: decoded twice as segment_audio
+used to (librosa.load for the duration, then audioBasicIO), decoded once with
+audioBasicIO, memory-mapped (read_audio) and handed to silenceRemoval, and
+memory-mapped with the block-by-block detection (low_memory). Each method runs
+in a fresh interpreter so that ru_maxrss is not shared; the peak is reported in
+MB and in bytes per sample of the track.
+
+    python benchmarks/segmentation_memory.py --minutes 60
+"""
+
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+fs = 16000
+methods = ['legacy', 'decode', 'memmap', 'streaming']
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def synthetic_wav(path, minutes, seed=0):
+    from scipy.io import wavfile
+
+    rng = np.random.RandomState(seed)
+    n = int(minutes * 60 * fs)
+    x = np.zeros(n, dtype=np.int16)
+    start = 0
+    while start < n:
+        speech = int(rng.uniform(2, 15) * fs)
+        x[start:start + speech] = (rng.standard_normal(min(speech, n - start)) * 3000).astype(np.int16)
+        start += speech + int(rng.uniform(0.3, 1.5) * fs)
+    wavfile.write(path, fs, x)
+
+
+def run(method, path):
+    from pyAudioAnalysis import audioBasicIO
+    from audio.wav_io import read_audio
+    import helpers.av_segmentation as seg
+
+    base = peak_rss_mb()
+    t0 = time.perf_counter()
+    if method == 'legacy':
+        import librosa
+        # the previous segment_audio: a librosa decode for the duration only, alive until the end
+        duration_signal, _ = librosa.load(path, sr=None)
+        rate, x = audioBasicIO.read_audio_file(path)
+    elif method == 'decode':
+        rate, x = audioBasicIO.read_audio_file(path)
+    else:
+        rate, x = read_audio(path)
+    segments = seg.segment_audio(os.path.basename(path), fs=rate, x=x, low_memory=method == 'streaming')
+    elapsed = time.perf_counter() - t0
+
+    print('{0:10s} peak RSS: {1:8.1f} MB (+{2:.1f} MB, {3:.1f} bytes/sample), {4:d} segments, {5:.2f} s'.format(
+        method, peak_rss_mb(), peak_rss_mb() - base, (peak_rss_mb() - base) * 1024 * 1024 / len(x),
+        len(segments), elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Silence detection peak-RSS benchmark')
+    parser.add_argument('--minutes', type=float, default=60, help='duration of the synthetic lecture')
+    parser.add_argument('--method', choices=methods, default=None)
+    parser.add_argument('--wav', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.method is not None:
+        run(args.method, args.wav)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'lecture.wav')
+        synthetic_wav(path, args.minutes)
+        print('{0:.0f} min track: {1:.1f} MB (16-bit WAV)'.format(args.minutes, os.path.getsize(path) / 1024.0 / 1024.0))
+        for method in methods:
+            subprocess.call([sys.executable, os.path.realpath(__file__), '--method', method, '--wav', path])
+
+
+if __name__ == '__main__':
+    main()
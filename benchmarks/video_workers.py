@@ -0,0 +1,41 @@
+"""
+Scaling benchmark of the video feature extraction worker pool.
+
+Runs Video2feature on the segments listed in <data>/index.csv with an
+increasing number of workers and reports segments/sec and speedup.
+
+    python benchmarks/video_workers.py --data data/target_5m --workers 1 2 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+
+import Video2Features.Video2Features as vf
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Video feature extraction scaling benchmark')
+    parser.add_argument('--data', default='data/target_5m', help='data folder with index.csv and video/')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--intra-op-threads', type=int, default=1)
+    parser.add_argument('--frame-rate', type=float, default=4)
+    args = parser.parse_args()
+
+    base = None
+    for n_jobs in args.workers:
+        t0 = time.perf_counter()
+        df = vf.Video2feature(pathIn=args.data + '/', frameRate=args.frame_rate, save=False, trainmode=False,
+                              n_jobs=n_jobs, intra_op_threads=args.intra_op_threads)
+        elapsed = time.perf_counter() - t0
+        if base is None:
+            base = elapsed
+        print('workers: {0:2d}  segments/sec: {1:6.2f}  speedup: {2:.2f}x'.format(
+            n_jobs, df.shape[0] / elapsed, base / elapsed))
+
+
+if __name__ == '__main__':
+    main()
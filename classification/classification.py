@@ -1,9 +1,12 @@
 from sklearn.svm import SVC
 from sklearn.metrics import accuracy_score, confusion_matrix
-from .preprocessing import do_preprocessing
-import pandas as pd
+from sklearn.model_selection import LeaveOneGroupOut
+from joblib import Parallel, delayed
+from sklearn.preprocessing import StandardScaler
+from .preprocessing import do_preprocessing, Preprocessor
 import statistics as st
 import pickle
+import os
 
 # Dataframe Columns
 c_file = 'FILE'
@@ -12,27 +15,49 @@ c_label = 'CLASS_1'
 
 # Model default name
 model_name ='svm_model.sav'
+# Fingerprint of the video projection the model was trained with
+projection_name = 'svm_model.projection'
+# Preprocessing (scaler & column schema) fitted with the model
+preprocessor_name = 'svm_model.preprocessor'
+# Audio features the model was trained on: 'segment' (one extraction per segment file)
+# or 'lecture' (whole-lecture extraction pooled per segment, see audio_features.lecture_features)
+audio_mode_name = 'svm_model.audio'
 
 #############################
 # CLASSIFICATION METHODS    #
 #############################
 
-def evaluate_training(df):
+def evaluate_training(df, n_jobs=1):
     '''
     Evaluates the algorithm performance on learning the provided
-    dataset. Run in rounds - each speaker versus all
+    dataset. Run in rounds - each speaker versus all. The rounds
+    (leave-one-speaker-out folds) run in parallel on `n_jobs` processes;
+    every round is standardized with the statistics of its training set.
 
     :param df:          the dataframe with audio & video data
+    :param n_jobs:      number of parallel folds (-1 for all cores)
+    :return:            the mean accuracy over the speakers
 
     '''
 
-    # Preprocessing (standardisation and conversion of categorical values to numeric)
-    df = do_preprocessing(df)
     labels = ['boring', 'neutral', 'interesting']
     # labels = [0, 2, 1] # Note: Use these labels if categorical -> numeric is done
 
-    # Unique speakers
-    speakers = df['FILE'].unique()
+    # Features (not standardized), labels and speakers as arrays (shared by all the folds)
+    data_Y = df[c_label].values
+    data_X = df.select_dtypes(include=['float64']).values
+    groups = df[c_file].values
+
+    # Fold indices, computed once: each speaker versus all
+    folds = list(LeaveOneGroupOut().split(data_X, data_Y, groups))
+
+    # Fit & predict the folds in parallel
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate_fold)(data_X, data_Y, train_idx, test_idx, labels) for train_idx, test_idx in folds)
+
+    # Results by speaker, printed in the order of the dataframe
+    by_speaker = {groups[test_idx[0]]: result for (_, test_idx), result in zip(folds, results)}
+    speakers = df[c_file].unique()
 
     # Array to hold model accuracy for each round
     acc_array = []
@@ -40,47 +65,72 @@ def evaluate_training(df):
     print('---------------------------')
     print('    Confusion matrices     ')
     print('---------------------------')
+    total_cf = 0
     for speaker in speakers:
-        # Split dataframe to train-test based on current speaker
-        train_X, train_Y, test_X, test_Y = split_train_test(df, speaker)
-
-        # Create the model
-        model = SVC(kernel='rbf')
-
-        # Fit
-        model.fit(train_X, train_Y)
-
-        # Predict
-        pred_Y = model.predict(test_X)
-
-        # Evaluate and append
-        acc_array.append(accuracy_score(test_Y, pred_Y))
+        acc, cf = by_speaker[speaker]
+        acc_array.append(acc)
+        total_cf = total_cf + cf
 
         # Print confusion matrix
-        cf = confusion_matrix(y_pred=pred_Y, y_true=test_Y, labels=labels)
         print('Speaker: ' + speaker)
         print('---------------------------')
         print(cf)
 
+    print('All speakers')
+    print('---------------------------')
+    print(total_cf)
+
     return st.mean(acc_array)
 
 
-def train(df, data_dir='data'):
+def evaluate_fold(data_X, data_Y, train_idx, test_idx, labels):
+    '''
+    Standardizes, trains and evaluates the model of one round (fold).
+
+    :param data_X:      the features of all the segments
+    :param data_Y:      the labels of all the segments
+    :param train_idx:   the rows of the training set
+    :param test_idx:    the rows of the test set (the left-out speaker)
+    :param labels:      the order of the labels in the confusion matrix
+    :return:            the accuracy and the confusion matrix
+    '''
+
+    # Standardisation (fitted on the training speakers only)
+    scaler = StandardScaler()
+    train_X = scaler.fit_transform(data_X[train_idx])
+    test_X = scaler.transform(data_X[test_idx])
+
+    # Create the model
+    model = SVC(kernel='rbf')
+
+    # Fit
+    model.fit(train_X, data_Y[train_idx])
+
+    # Predict
+    pred_Y = model.predict(test_X)
+
+    test_Y = data_Y[test_idx]
+    return accuracy_score(test_Y, pred_Y), confusion_matrix(y_pred=pred_Y, y_true=test_Y, labels=labels)
+
+
+def train(df, data_dir='data', projection=None, audio_mode='segment'):
     '''
     Trains an SVM model in the provided dataset.
 
     :param df:          the dataframe with audio & video data
     :param data_dir:    the data directory
+    :param projection:  fingerprint of the video projection used for df
+    :param audio_mode:  how the audio features of df were extracted ('segment' or 'lecture')
     :return:            the trained model
     '''
 
-    # Preprocessing (standardisation and conversion of categorical values to numeric)
-    df = do_preprocessing(df)
+    # Preprocessing (standardisation, fitted here and saved with the model)
+    preprocessor = Preprocessor().fit(df)
+    df = preprocessor.transform(df)
 
     # Get train data (features and labels)
-    train = df.drop(c_drop, axis=1)
-    train_Y = train[c_label]
-    train_X = train[train.columns[1:]]
+    train_Y = df[c_label]
+    train_X = df[preprocessor.columns]
 
     # Create the model
     model = SVC(kernel='rbf')
@@ -91,19 +141,31 @@ def train(df, data_dir='data'):
     print('SVM model trained.')
 
     # Save model
-    save_model(model, data_dir)
+    save_model(model, data_dir, projection, preprocessor, audio_mode)
 
     return model
 
 
-def evaluate_target(model, target_df):
+def evaluate_target(model, target_df, preprocessor=None):
+    '''
+    Predicts the labels of the target segments.
 
-    # Preprocessing (standardisation and conversion of categorical values to numeric)
-    df = do_preprocessing(target_df)
+    :param model:           the trained model
+    :param target_df:       the dataframe with audio & video data of the target
+    :param preprocessor:    the preprocessing fitted with the model (see load_preprocessor)
+    :return:                the target dataframe with the predicted labels
+    '''
 
-    # Get features from dataframe
-    target_data = df.drop(c_drop, axis=1)
-    target_data_X = target_data[target_data.columns]
+    if preprocessor is not None:
+        # Preprocessing (transform only, with the training statistics)
+        df = preprocessor.transform(target_df)
+        target_data_X = df[preprocessor.columns]
+    else:
+        # Models saved without their preprocessing: standardize the target on its own statistics
+        print('Warning: no preprocessing saved with the model, the target is standardized on its own.')
+        df = do_preprocessing(target_df)
+        target_data = df.drop(c_drop, axis=1)
+        target_data_X = target_data[target_data.columns]
 
     # Predict
     pred_Y = model.predict(target_data_X)
@@ -117,57 +179,97 @@ def evaluate_target(model, target_df):
     return target_df
 
 
-def split_train_test(df, speaker):
-    '''
-    Splits the provided dataframe (audio & video fetures with
-    speakers and labels) to train and test based on speaker 
-    (one vs all).
-
-    :param df:          the dataframe with audio & video data
-    :param speaker:     the speaker for the 1 vs all
-
-    '''
-
-    # Train
-    train = df[df[c_file] != speaker].drop(c_drop, axis=1)
-    train_Y = train[c_label]
-    train_X = train[train.columns[1:]]
-
-    # Test
-    test = df[df[c_file] == speaker].drop(c_drop, axis=1)
-    test_Y = test[c_label]
-    test_X = test[test.columns[1:]]
-
-    return train_X, train_Y, test_X, test_Y
-
-
 #############################
 # SAVE/LOAD MODEL METHODS   #
 #############################
 
-def save_model(model, data_dir='data'):
+def save_model(model, data_dir='data', projection=None, preprocessor=None, audio_mode=None):
     '''
     Merely saves the provided ML model to a pickle file.
 
-    :param model:       the trained model 
-    :param data_dir:    the data directory
+    :param model:           the trained model 
+    :param data_dir:        the data directory
+    :param projection:      fingerprint of the video projection (saved next to the model)
+    :param preprocessor:    the fitted preprocessing (saved next to the model)
+    :param audio_mode:      how the audio features were extracted (saved next to the model)
     '''
 
     filename = data_dir + '/' + model_name
     pickle.dump(model, open(filename, 'wb'))
 
+    if preprocessor is not None:
+        pickle.dump(preprocessor, open(data_dir + '/' + preprocessor_name, 'wb'))
+
+    if projection is not None:
+        with open(data_dir + '/' + projection_name, 'w') as f:
+            f.write(projection)
+
+    if audio_mode is not None:
+        with open(data_dir + '/' + audio_mode_name, 'w') as f:
+            f.write(audio_mode)
+
     print('SVM model saved in "' + filename + '"')
 
 
-def load_model(data_dir='data'):
+def load_model(data_dir='data', projection=None, audio_mode=None):
     '''
 
     :param data_dir: 
+    :param projection:  fingerprint of the video projection used for the target
+                        features; must match the one saved with the model
+    :param audio_mode:  how the audio features of the target were extracted ('segment' or
+                        'lecture'); must match the one saved with the model
     :return:            the loaded model 
     '''
+    if audio_mode is not None:
+        check_audio_mode(data_dir, audio_mode)
+
     filename = data_dir + '/' + model_name
     model = pickle.load(open(filename, 'rb'))
 
+    projection_file = data_dir + '/' + projection_name
+    if projection is not None and os.path.exists(projection_file):
+        with open(projection_file) as f:
+            model_projection = f.read().strip()
+        if model_projection != projection:
+            raise ValueError('Video projection mismatch: model was trained with "' + model_projection +
+                             '", target features use "' + projection + '"')
+
     print('SVM model successfully loaded.')
 
-    return model
\ No newline at end of file
+    return model
+
+
+def check_audio_mode(data_dir, audio_mode):
+    '''
+    Checks that the target audio features are extracted the way the model's
+    were. The whole-lecture features differ from the per-segment ones (see
+    benchmarks/lecture_audio_features.py), so they are not scored by a model
+    trained on the others.
+
+    :param data_dir:    the directory of the model
+    :param audio_mode:  how the audio features of the target are extracted ('segment' or 'lecture')
+    '''
+    filename = data_dir + '/' + audio_mode_name
+    # models saved without it were trained on per-segment features
+    model_audio_mode = 'segment'
+    if os.path.exists(filename):
+        with open(filename) as f:
+            model_audio_mode = f.read().strip()
+    if model_audio_mode != audio_mode:
+        raise ValueError('Audio features mismatch: model was trained on "' + model_audio_mode +
+                         '" audio features, target features are "' + audio_mode + '"')
+
+
+def load_preprocessor(data_dir='data'):
+    '''
+    Loads the preprocessing saved with the model.
+
+    :param data_dir:    the data directory
+    :return:            the fitted preprocessor, or None for models saved without it
+    '''
+    filename = data_dir + '/' + preprocessor_name
+    if not os.path.exists(filename):
+        return None
+
+    return pickle.load(open(filename, 'rb'))
@@ -28,7 +28,7 @@ def standardize(df):
 
     # Fit your data on the scaler object
     scaled_df = scaler.fit_transform(df[float_columns])
-    scaled_df = pd.DataFrame(scaled_df, columns=float_columns)
+    scaled_df = pd.DataFrame(scaled_df, columns=float_columns, index=df.index)
 
     # Concat with non float columns (removed before standardization)
     scaled_df = pd.concat([df[string_columns], scaled_df], axis=1, join='inner')
@@ -36,6 +36,65 @@ def standardize(df):
     return scaled_df
 
 
+class Preprocessor(object):
+    '''
+    Standardization fitted once on the training data and saved with the
+    model, so that target data (down to a single segment) is transformed
+    with the training statistics instead of being standardized on its own.
+
+    The column schema (the float feature columns, in training order) is
+    kept with the scaler; data with missing feature columns is rejected.
+    '''
+
+    def __init__(self):
+        self.columns = None
+        self.scaler = None
+
+    def fit(self, df):
+        '''
+        Fits the scaler on the float columns of the provided dataframe.
+
+        :param df:  the training dataframe
+        :return:    self
+        '''
+
+        self.columns = df.select_dtypes(include=['float64']).columns.to_list()
+        self.scaler = pp.StandardScaler()
+        self.scaler.fit(df[self.columns].values)
+
+        return self
+
+    def transform_array(self, X):
+        '''
+        Standardizes a feature matrix whose columns follow the schema.
+
+        :param X:   n x d feature matrix
+        :return:    the standardized matrix
+        '''
+
+        return self.scaler.transform(X)
+
+    def transform(self, df):
+        '''
+        Standardizes the provided dataframe with the fitted scaler. The
+        output has the layout of `standardize`: the non-float columns
+        first, then the feature columns in training order (float columns
+        unknown to the schema are dropped).
+
+        :param df:  the input dataframe
+        :return:    the standardized dataframe
+        '''
+
+        missing = [c for c in self.columns if c not in df.columns]
+        if missing:
+            raise ValueError('Missing feature columns: ' + ', '.join(str(c) for c in missing[:10]))
+
+        other_columns = df.select_dtypes(exclude=['float64']).columns.to_list()
+        scaled_df = pd.DataFrame(self.transform_array(df[self.columns].values), columns=self.columns, index=df.index)
+
+        return pd.concat([df[other_columns], scaled_df], axis=1)
+
+
 def categorical_2_numeric(df, columns):
     '''
     Converts dataframe category columns to numeric. Currently used only for label column.
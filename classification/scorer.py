@@ -0,0 +1,185 @@
+import time
+import numpy as np
+import Video2Features.Video2Features as vf
+import audio.audio_features as af
+from audio.video_to_audio import decode_audio
+from .classification import load_model, load_preprocessor
+
+#############################
+# SINGLE-SEGMENT SCORING    #
+#############################
+
+class LectureScorer(object):
+    '''
+    In-process scoring of single lecture segments. The model, the fitted
+    preprocessing, the video projection and the VGG16 embedding network are
+    loaded once; a segment (a video file, or raw frames and audio) is then
+    scored without segmentation, pickles or dataframe merges.
+
+    :param data_dir:            the directory of the model (see classification.train)
+    :param frame_rate:          seconds between the embedded frames (as Video2feature)
+    :param batch_size:          frames per VGG16 batch
+    :param projection:          the video projection (as Video2feature)
+    :param mt_win, mt_step:     audio mid-term window and step (s)
+    :param st_win, st_step:     audio short-term window and step (s)
+    :param intra_op_threads:    TF threads used inside one op (0 = TF default)
+    :param inter_op_threads:    TF threads used across ops (0 = TF default)
+    :param warm:                score a dummy segment once, so that the first call is not slower
+    '''
+
+    def __init__(self, data_dir='data', frame_rate=4, batch_size=32, projection='vector',
+                 mt_win=1.0, mt_step=1.0, st_win=0.050, st_step=0.050,
+                 intra_op_threads=0, inter_op_threads=0, warm=True):
+        self.frame_rate = frame_rate
+        self.batch_size = batch_size
+        self.projection = projection
+        self.audio_params = (mt_win, mt_step, st_win, st_step)
+
+        self.model = load_model(data_dir, projection=vf.projection_version(projection, trainmode=False),
+                                audio_mode='segment')
+        self.preprocessor = load_preprocessor(data_dir)
+        if self.preprocessor is None:
+            raise ValueError('No preprocessing saved with the model in "' + data_dir +
+                             '": retrain it to score single segments')
+        self.engine = vf.FrameEmbedder(intra_op_threads, inter_op_threads)
+
+        # positions of the model features in [video vector, audio vector], built on the first call
+        self.positions = None
+        # time spent in each step of the last call (s)
+        self.timings = {}
+
+        if warm:
+            self.score(frames=np.zeros((1, 224, 224, 3), dtype=np.uint8),
+                       signal=np.random.RandomState(0).randint(-100, 100, 16000).astype(np.int16), fs=16000)
+
+    def feature_positions(self, n_video, n_audio):
+        '''
+        Maps the model feature columns (merged names, see helpers.merge_features)
+        to positions in the concatenated [video vector, audio vector].
+
+        :param n_video:     length of the video vector
+        :param n_audio:     length of the audio vector
+        :return:            array of positions, in the order of the model columns
+        '''
+
+        positions = []
+        for column in self.preprocessor.columns:
+            name = str(column)
+            if name.endswith('_v'):
+                positions.append(int(name[:-2]))
+            elif name.endswith('_a'):
+                positions.append(n_video + int(name[:-2]))
+            else:
+                # columns of only one modality keep their name
+                index = int(name)
+                positions.append(index if index < n_video else n_video + index)
+
+        return np.array(positions, dtype=int)
+
+    def video_vectors(self, frame_lists):
+        '''
+        Embeds the frames of several segments together (VGG16 batches span
+        segments) and projects each segment to its video vector.
+
+        :param frame_lists: list of frame arrays, one per segment
+        :return:            list of video vectors
+        '''
+
+        frames = [frame for frame_list in frame_lists for frame in frame_list]
+        features = [self.engine.embed(frames[start:start + self.batch_size])
+                    for start in range(0, len(frames), self.batch_size)]
+        features = np.vstack(features) if features else None
+
+        vectors, start = [], 0
+        for frame_list in frame_lists:
+            count = len(frame_list)
+            vectors.append(vf.features2vector(features[start:start + count].mean(axis=0, dtype='float64'),
+                                              False, self.projection))
+            start += count
+
+        return vectors
+
+    def audio_vector(self, signal, fs):
+        _, features, _, reason, _ = af.segment_features((0, None, signal, fs) + self.audio_params)
+        if features is None:
+            raise ValueError('Audio of the segment cannot be scored: ' + reason)
+
+        return features
+
+    def score_batch(self, items):
+        '''
+        Scores several segments at once: one CNN pass over the frames of all
+        the segments and one SVM prediction for the whole batch.
+
+        :param items:   list of dicts with the `score` arguments (segment, or frames/signal/fs)
+        :return:        list with the (label, class scores) of every segment, or the
+                        exception raised for the segments that cannot be scored
+        '''
+
+        t0 = time.perf_counter()
+        results = [None] * len(items)
+        frame_lists, signals = [], []
+        for i, item in enumerate(items):
+            try:
+                frames = item.get('frames')
+                if frames is None:
+                    frames = list(vf.video2frames(item['segment'], self.frame_rate))
+                if len(frames) == 0:
+                    raise ValueError('No frames to score')
+                signal, fs = item.get('signal'), item.get('fs')
+                if signal is None:
+                    fs, signal = decode_audio(item['segment'])
+            except (KeyError, TypeError, ValueError, OSError) as e:
+                results[i] = e
+                frames, signal, fs = [], None, None
+            frame_lists.append(frames)
+            signals.append((signal, fs))
+        t1 = time.perf_counter()
+
+        valid = [i for i in range(len(items)) if results[i] is None]
+        videos = dict(zip(valid, self.video_vectors([frame_lists[i] for i in valid])))
+        t2 = time.perf_counter()
+
+        rows = []
+        for i in valid:
+            try:
+                audio = self.audio_vector(*signals[i])
+            except ValueError as e:
+                results[i] = e
+                continue
+            if self.positions is None:
+                self.positions = self.feature_positions(len(videos[i]), len(audio))
+            rows.append((i, np.concatenate((videos[i], audio))[self.positions]))
+        t3 = time.perf_counter()
+
+        if rows:
+            x = self.preprocessor.transform_array(np.vstack([row for _, row in rows]))
+            labels = self.model.predict(x)
+            decisions = self.model.decision_function(x).reshape(len(rows), -1)
+            for (i, _), label, decision in zip(rows, labels, decisions):
+                results[i] = (label, dict(zip(self.model.classes_, decision)))
+        t4 = time.perf_counter()
+
+        self.timings = {'decode': t1 - t0, 'video': t2 - t1, 'audio': t3 - t2, 'predict': t4 - t3, 'total': t4 - t0}
+
+        return results
+
+    def score(self, segment=None, frames=None, signal=None, fs=None):
+        '''
+        Scores one segment.
+
+        :param segment: the segment video file (frames and audio are decoded from it)
+        :param frames:  RGB frames of the segment (n x 224 x 224 x 3), instead of decoding `segment`
+        :param signal:  audio signal of the segment, instead of decoding `segment`
+        :param fs:      sampling rate of `signal`
+        :return:        the predicted label and the class scores (dict label -> decision value)
+        '''
+
+        result = self.score_batch([{'segment': segment, 'frames': frames, 'signal': signal, 'fs': fs}])[0]
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    def close(self):
+        self.engine.close()
@@ -0,0 +1,295 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+#############################
+# BATCHING SCORING SERVICE  #
+#############################
+
+class ScoringService(object):
+    '''
+    Keeps a LectureScorer resident and scores the queued requests in
+    batches: the requests that arrive while a batch is being scored (up to
+    `max_batch`, waiting at most `max_wait` seconds for more) share one CNN
+    pass and one SVM prediction.
+
+    The scorer is created (and only used) by the batching thread, so the
+    TF session is never shared between threads.
+
+    :param scorer_args: arguments of LectureScorer (e.g. data_dir)
+    :param max_batch:   maximum number of segments per batch
+    :param max_wait:    time to wait for more requests before scoring a batch (s)
+    :param history:     number of recent requests/batches kept for the metrics
+    :param job_ttl:     time after which a finished job that was not fetched is forgotten (s)
+    :param max_jobs:    maximum number of jobs kept; the oldest finished ones are forgotten first
+    :param scorer_factory:  callable creating the scorer from `scorer_args` (LectureScorer by default)
+    '''
+
+    def __init__(self, scorer_args=None, max_batch=8, max_wait=0.01, history=1000, job_ttl=600, max_jobs=10000,
+                 scorer_factory=None):
+        self.scorer_args = scorer_args if scorer_args is not None else {}
+        self.scorer_factory = scorer_factory
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+
+        self.requests = queue.Queue()
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.error = None
+
+        # metrics
+        self.started = time.time()
+        self.n_requests = 0
+        self.n_errors = 0
+        self.n_batches = 0
+        self.n_expired = 0
+        self.latencies = deque(maxlen=history)
+        self.queue_waits = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        scorer_factory = self.scorer_factory
+        if scorer_factory is None:
+            from .scorer import LectureScorer
+            scorer_factory = LectureScorer
+
+        try:
+            scorer = scorer_factory(**self.scorer_args)
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+            return
+        self.ready.set()
+
+        while True:
+            batch = [self.requests.get()]
+            if batch[0] is None:
+                break
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+
+            t0 = time.perf_counter()
+            try:
+                results = scorer.score_batch([item for item, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+            t1 = time.perf_counter()
+
+            with self.lock:
+                self.n_batches += 1
+                self.batch_sizes.append(len(batch))
+                for (_, future, submitted), result in zip(batch, results):
+                    self.n_requests += 1
+                    self.latencies.append(t1 - submitted)
+                    self.queue_waits.append(t0 - submitted)
+                    if isinstance(result, Exception):
+                        self.n_errors += 1
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+        scorer.close()
+
+    def submit(self, item):
+        '''
+        Queues a segment for scoring.
+
+        :param item:    dict with the LectureScorer.score arguments (segment, or frames/signal/fs)
+        :return:        a Future with the (label, class scores) of the segment
+        '''
+        future = Future()
+        self.requests.put((item, future, time.perf_counter()))
+        return future
+
+    def submit_job(self, item):
+        '''
+        Queues a segment and returns a job id; the result is fetched later
+        with `result`.
+        '''
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.expire_jobs()
+            self.jobs[job_id] = (self.submit(item), time.time())
+        return job_id
+
+    def result(self, job_id):
+        '''
+        :param job_id:  the id returned by `submit_job`
+        :return:        the job Future (None for unknown or expired ids); finished jobs are forgotten once fetched
+        '''
+        with self.lock:
+            self.expire_jobs()
+            future, _ = self.jobs.get(job_id, (None, None))
+            if future is not None and future.done():
+                del self.jobs[job_id]
+        return future
+
+    def expire_jobs(self):
+        '''
+        Forgets the finished jobs older than `job_ttl`, and the oldest
+        finished jobs beyond `max_jobs`; pending jobs are kept. Called with
+        the lock held.
+        '''
+        deadline = time.time() - self.job_ttl
+        excess = len(self.jobs) - self.max_jobs + 1
+        # jobs are in submission order
+        for job_id, (future, submitted) in list(self.jobs.items()):
+            if submitted >= deadline and excess <= 0:
+                break
+            if future.done():
+                del self.jobs[job_id]
+                self.n_expired += 1
+                excess -= 1
+
+    def metrics(self):
+        with self.lock:
+            latencies = np.array(self.latencies) * 1000
+            queue_waits = np.array(self.queue_waits) * 1000
+            batch_sizes = np.array(self.batch_sizes)
+            return {
+                'uptime_s': round(time.time() - self.started, 1),
+                'queue_depth': self.requests.qsize(),
+                'pending_jobs': sum(1 for future, _ in self.jobs.values() if not future.done()),
+                'stored_jobs': len(self.jobs),
+                'expired_jobs': self.n_expired,
+                'requests': self.n_requests,
+                'errors': self.n_errors,
+                'batches': self.n_batches,
+                'batch_size_mean': round(float(batch_sizes.mean()), 2) if len(batch_sizes) else None,
+                'batch_size_max': int(batch_sizes.max()) if len(batch_sizes) else None,
+                'latency_p50_ms': round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+                'latency_p99_ms': round(float(np.percentile(latencies, 99)), 2) if len(latencies) else None,
+                'queue_wait_p50_ms': round(float(np.percentile(queue_waits, 50)), 2) if len(queue_waits) else None,
+            }
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+def result2json(result):
+    label, scores = result
+    return {'label': str(label), 'scores': {str(k): float(v) for k, v in scores.items()}}
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP API of the scoring service (JSON):
+        POST /score         {"segment": "<video file>"} -> {"label": ..., "scores": {...}}
+        POST /jobs          {"segment": "<video file>"} -> {"id": ...} (scored in the background)
+        GET  /jobs/<id>     -> {"status": "pending"} or the result (404 once fetched or expired)
+        GET  /metrics       -> queue depth, batch sizes, latency percentiles
+    '''
+
+    def send_json(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_item(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        if not isinstance(body, dict) or 'segment' not in body:
+            raise ValueError('expected {"segment": "<video file>"}')
+        return {'segment': body['segment']}
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            item = self.read_item()
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+            return
+
+        if self.path == '/score':
+            try:
+                self.send_json(200, result2json(service.submit(item).result()))
+            except Exception as e:
+                self.send_json(422, {'error': str(e)})
+        elif self.path == '/jobs':
+            self.send_json(202, {'id': service.submit_job(item)})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/metrics':
+            self.send_json(200, service.metrics())
+        elif self.path.startswith('/jobs/'):
+            future = service.result(self.path[len('/jobs/'):])
+            if future is None:
+                self.send_json(404, {'error': 'unknown or expired job'})
+            elif not future.done():
+                self.send_json(200, {'status': 'pending'})
+            elif future.exception() is not None:
+                self.send_json(200, {'status': 'failed', 'error': str(future.exception())})
+            else:
+                self.send_json(200, dict(result2json(future.result()), status='done'))
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def log_message(self, format, *args):
+        # the metrics replace the per-request access log
+        pass
+
+
+def serve(data_dir='data', host='127.0.0.1', port=8000, max_batch=8, max_wait=0.01, job_ttl=600,
+          scorer_factory=None, on_ready=None):
+    '''
+    Runs the scoring service until interrupted (or until `shutdown` is
+    called on the server).
+
+    :param data_dir:    the directory of the model
+    :param host:        the listening address (local only by default)
+    :param port:        the listening port (0 for any free port)
+    :param max_batch:   maximum number of segments per batch
+    :param max_wait:    time to wait for more requests before scoring a batch (s)
+    :param job_ttl:     time after which a finished job that was not fetched is forgotten (s)
+    :param scorer_factory:  callable creating the scorer (LectureScorer by default)
+    :param on_ready:    called with the server once it is listening
+    '''
+
+    service = ScoringService({'data_dir': data_dir}, max_batch=max_batch, max_wait=max_wait, job_ttl=job_ttl,
+                             scorer_factory=scorer_factory)
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.service = service
+    print('Scoring service listening on http://' + host + ':' + str(server.server_address[1]))
+    if on_ready is not None:
+        on_ready(server)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
@@ -0,0 +1,182 @@
+from sklearn.svm import SVC
+from sklearn.model_selection import LeaveOneGroupOut, ParameterGrid, ParameterSampler
+from joblib import Parallel, delayed
+import numpy as np
+import pandas as pd
+
+# Dataframe Columns
+c_file = 'FILE'
+c_label = 'CLASS_1'
+
+# Default search space ('auto': 1 / number of features, the SVC default)
+default_grid = {
+    'C': [0.1, 1, 10, 100],
+    'gamma': ['auto', 1e-4, 1e-3, 1e-2, 1e-1],
+    'features': ['both', 'video', 'audio'],
+}
+
+# Search results default name
+results_name = 'tuning.csv'
+
+#############################
+# HYPERPARAMETER SEARCH     #
+#############################
+
+def tune(df, modalities=None, grid=None, n_iter=None, n_jobs=1, random_state=0, data_dir=None):
+    '''
+    Searches the SVM parameters (C, gamma) and the feature subset (video,
+    audio or both) with leave-one-video-out folds. The search is a full
+    grid search, or a random search over `n_iter` candidates of the grid.
+
+    Every (feature subset, fold) task standardizes its fold once (scaler
+    fitted on the training speakers only) and computes the squared
+    distances between the segments once; the RBF kernel of every gamma is
+    derived from them and shared by all the C values (SVC with a
+    precomputed kernel). The tasks run in parallel on `n_jobs` processes.
+
+    :param df:              the merged dataframe with audio & video data (not standardized)
+    :param modalities:      dict with the 'video' and 'audio' columns (see helpers.modality_columns);
+                            None: search over all the features only
+    :param grid:            the search space (see default_grid)
+    :param n_iter:          number of random candidates (None: full grid; at most the grid size)
+    :param n_jobs:          number of parallel tasks (-1 for all cores)
+    :param random_state:    seed of the random search
+    :param data_dir:        if set, the results are saved there as csv
+    :return:                the results dataframe (best candidate first)
+    '''
+
+    if grid is None:
+        grid = default_grid
+    if modalities is None:
+        grid = dict(grid, features=['both'])
+
+    # Candidates
+    if n_iter is None:
+        candidates = list(ParameterGrid(grid))
+    else:
+        # ParameterSampler cannot draw more candidates than the grid has
+        n_iter = min(n_iter, len(ParameterGrid(grid)))
+        candidates = list(ParameterSampler(grid, n_iter=n_iter, random_state=random_state))
+
+    # Feature subsets (as column positions)
+    float_columns = df.select_dtypes(include=['float64']).columns.to_list()
+    subsets = {'both': np.arange(len(float_columns))}
+    if modalities is not None:
+        positions = {c: i for i, c in enumerate(float_columns)}
+        for name in ('video', 'audio'):
+            subsets[name] = np.array([positions[c] for c in modalities[name] if c in positions], dtype=int)
+
+    data_X = df[float_columns].values
+    data_Y = df[c_label].values
+    groups = df[c_file].values
+
+    # Fold indices, computed once: each video (speaker) versus all
+    folds = list(LeaveOneGroupOut().split(data_X, data_Y, groups))
+
+    # One task per (feature subset, fold), evaluating all the candidates of the subset
+    tasks = []
+    for name in sorted(set(c['features'] for c in candidates)):
+        params = [(c['C'], c['gamma']) for c in candidates if c['features'] == name]
+        for fold, (train_idx, test_idx) in enumerate(folds):
+            tasks.append((name, fold, params, train_idx, test_idx))
+
+    print('Tuning: ' + str(len(candidates)) + ' candidates, ' + str(len(folds)) + ' folds, ' +
+          str(len(tasks)) + ' tasks')
+
+    scores = Parallel(n_jobs=n_jobs)(
+        delayed(evaluate_candidates)(data_X[:, subsets[name]], data_Y, train_idx, test_idx, params)
+        for name, fold, params, train_idx, test_idx in tasks)
+
+    # Mean accuracy over the folds (as evaluate_training)
+    accuracies = {}
+    for (name, fold, params, _, _), fold_scores in zip(tasks, scores):
+        for (C, gamma), acc in zip(params, fold_scores):
+            accuracies.setdefault((name, C, str(gamma)), []).append(acc)
+
+    rows = []
+    for c in candidates:
+        acc = accuracies[(c['features'], c['C'], str(c['gamma']))]
+        rows.append({'features': c['features'], 'C': c['C'], 'gamma': c['gamma'],
+                     'accuracy': np.mean(acc), 'accuracy_std': np.std(acc)})
+    results = pd.DataFrame(rows, columns=['features', 'C', 'gamma', 'accuracy', 'accuracy_std'])
+    results = results.sort_values('accuracy', ascending=False, kind='mergesort').reset_index(drop=True)
+
+    print('---------------------------')
+    print('    Best candidates        ')
+    print('---------------------------')
+    print(results.head(10).to_string(index=False))
+
+    if data_dir is not None:
+        filename = data_dir + '/' + results_name
+        results.to_csv(filename, index=False)
+        print('Tuning results saved in "' + filename + '"')
+
+    return results
+
+
+def evaluate_candidates(data_X, data_Y, train_idx, test_idx, params):
+    '''
+    Evaluates the (C, gamma) candidates on one fold. The fold is
+    standardized and its squared distances are computed once for all the
+    candidates.
+
+    :param data_X:      the features (of one subset) of all the segments
+    :param data_Y:      the labels of all the segments
+    :param train_idx:   the rows of the training set
+    :param test_idx:    the rows of the test set (the left-out video)
+    :param params:      list of (C, gamma) candidates
+    :return:            the accuracy of every candidate
+    '''
+
+    train_X, test_X = standardize_fold(data_X[train_idx], data_X[test_idx])
+    train_Y, test_Y = data_Y[train_idx], data_Y[test_idx]
+
+    train_dist = squared_distances(train_X, train_X)
+    test_dist = squared_distances(test_X, train_X)
+
+    scores = []
+    kernels = {}
+    for C, gamma in params:
+        if gamma not in kernels:
+            value = 1.0 / data_X.shape[1] if gamma == 'auto' else gamma
+            kernels[gamma] = (np.exp(-value * train_dist), np.exp(-value * test_dist))
+        train_K, test_K = kernels[gamma]
+
+        model = SVC(kernel='precomputed', C=C)
+        model.fit(train_K, train_Y)
+        pred_Y = model.predict(test_K)
+        scores.append(np.mean(pred_Y == test_Y))
+
+    return scores
+
+
+def standardize_fold(train_X, test_X):
+    '''
+    Standardizes a fold with the mean and standard deviation of its
+    training set.
+
+    :param train_X:     the training features
+    :param test_X:      the test features
+    :return:            the standardized training and test features
+    '''
+
+    mean = train_X.mean(axis=0)
+    std = train_X.std(axis=0)
+    std[std == 0] = 1.0
+
+    return (train_X - mean) / std, (test_X - mean) / std
+
+
+def squared_distances(a, b):
+    '''
+    Squared euclidean distances between the rows of `a` and `b`.
+
+    :param a:   n x d matrix
+    :param b:   m x d matrix
+    :return:    n x m matrix
+    '''
+
+    dist = (a * a).sum(axis=1)[:, np.newaxis] + (b * b).sum(axis=1)[np.newaxis, :] - 2.0 * a.dot(b.T)
+    np.maximum(dist, 0, out=dist)
+
+    return dist
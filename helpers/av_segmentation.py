@@ -6,10 +6,12 @@
 ###########
 
 import os
-import librosa
+import collections
+import numpy as np
 import time
+import subprocess
 from pyAudioAnalysis.audioSegmentation import silenceRemoval as sR
-from pyAudioAnalysis.audioBasicIO import read_audio_file
+from audio.wav_io import read_audio, skip_wav_header
 import shutil
 import progressbar
 
@@ -22,62 +24,54 @@ def segment_audio(audio_fn,
                   audio_dir='./data/audio_wav',
                   st_win=0.05,
                   st_step=0.05,
-                  up_bound=20):
+                  up_bound=20,
+                  fs=None,
+                  x=None,
+                  low_memory=False):
     """
     Partition an audio track into smaller segments; the duration of each segment (with the exception of the last one)
     is at most `up_bound`.
 
+    `silenceRemoval` converts the whole track to float64 (and normalizes it) before extracting its features, so
+    its peak memory is a few float64 copies of the track (8 bytes per sample each, 4 times a 16-bit WAV) even
+    when `x` is memory-mapped (see benchmarks/segmentation_memory.py). With `low_memory` the silences are
+    detected block by block over the track with `StreamingSegmenter` instead, in bounded memory; its threshold
+    adapts to the recent audio, so the segments differ slightly from those of `silenceRemoval`.
+
     Input:
       audio_fn:         the filename of the audio track, e.g. 'audio_1.wav'
       audio_dir:        the directory of audio tracks (in `wav` format)
       st_win, st_step:  short term window and step
       up_bound:         upper bound on the duration of segments (in seconds)
+      fs, x:            sampling rate and signal of the track, if already decoded (the file is then not read)
+      low_memory:       detect the silences block by block (bounded memory)
     Output:
       a list of audio segments of the form [[a0, b0], [a1, b1], ...]
     """
-    # audio track duration using `librosa`
-    audio_path = os.path.join(audio_dir, audio_fn)
-    y, sr = librosa.load(audio_path, sr=None)
-    audio_duration = librosa.core.get_duration(y=y, sr=sr)
+    if x is None:
+        # map the track once (fs: sampling rate, x = audio as memory-mapped `numpy` array)
+        audio_path = os.path.join(audio_dir, audio_fn)
+        fs, x = read_audio(audio_path)
+
+    # audio track duration from the decoded samples (a separate `librosa` decode
+    # would hold a second, float32 copy of the whole track)
+    audio_duration = float(len(x)) / fs
+
+    if low_memory:
+        return stream_segments(x, fs, st_win=st_win, st_step=st_step, up_bound=up_bound)
 
     # determine start and end points of silent parts using `pyAudioAnalysis`
-    fs, x = read_audio_file(audio_path)  # fs: sampling rate, x = audio as `numpy` array
     seg_lims = sR(x=x, fs=fs, st_win=st_win, st_step=st_step)
     seg_num = len(seg_lims)
     # print(seg_num)
 
     # determine cutoff points: eligible points for segmenting the audio track
     cutoffs = [seg_lims[idx][0] + 0.5 * (seg_lims[idx][1] - seg_lims[idx][0]) for idx in range(seg_num)]
-    cutoffs = [0.0] + cutoffs  # appending the start of the audio track
 
     # determine audio segments: compute the beginning and end points (in seconds) of audio segments
-    segments = []
-    running_idx = 0
-
-    while True:
-        if running_idx == 0:
-            start_point = 0.0
-        else:
-            start_point = cutoffs[running_idx]
-        # print('start point', start_point)
-        durations = [cutoff for cutoff in cutoffs if 0 <= cutoff - start_point < up_bound]
-        # print(durations)
-        end_point = durations[-1]
-        # print(end_point)
-        running_idx += len(durations) - 1
-        if running_idx == seg_num:
-            break
-        segments.append([start_point, end_point])
-    # print(segments)
+    segments = cutoffs2segments(cutoffs, audio_duration, up_bound=up_bound)
 
     # regularizations
-    # [a] extending to the end of the audio track
-    # print(segments[-1])
-    if audio_duration - segments[-1][1] < 6:
-        segments[-1][1] = audio_duration
-    else:
-        segments.append([segments[-1][1], audio_duration])
-    # print(segments[-1])
     # [b] increment the start point of each segment (except the first one) by 0.01
     offset = 0.01
     # print(segments[0][0], segments[1][0])
@@ -88,11 +82,323 @@ def segment_audio(audio_fn,
     return segments
 
 
+def cutoffs2segments(cutoffs, audio_duration, up_bound=20, min_tail=6):
+    """
+    Build the segments of an audio track from its cutoff points in a single (two-pointer) pass.
+    Each segment ends at the last cutoff less than `up_bound` after its start; a stretch without
+    any cutoff for `up_bound` seconds (long speech) is force-split every `up_bound` seconds.
+
+    Input:
+      cutoffs:          eligible points for segmenting the track (in seconds, any order)
+      audio_duration:   duration of the track (in seconds)
+      up_bound:         upper bound on the duration of segments (in seconds)
+      min_tail:         a last segment shorter than this is merged into the previous one
+    Output:
+      a list of audio segments of the form [[a0, b0], [a1, b1], ...], covering [0, audio_duration]
+    """
+    # start of the track, sorted cutoffs inside the track, end of the track
+    cutoffs = np.sort(np.asarray(cutoffs, dtype=float))
+    cutoffs = cutoffs[(cutoffs > 0) & (cutoffs < audio_duration)]
+    points = np.concatenate(([0.0], cutoffs, [audio_duration]))
+    n_points = len(points)
+
+    segments = []
+    start_point = 0.0
+    running_idx = 0  # last point at or before `start_point`
+    while start_point < audio_duration:
+        end_idx = running_idx
+        while end_idx + 1 < n_points and points[end_idx + 1] - start_point < up_bound:
+            end_idx += 1
+        if end_idx == n_points - 1:
+            segments.append([start_point, float(audio_duration)])
+            break
+        if end_idx == running_idx:
+            # no cutoff within `up_bound`: force split
+            end_point = start_point + up_bound
+        else:
+            end_point = float(points[end_idx])
+        segments.append([start_point, end_point])
+        start_point = end_point
+        running_idx = end_idx
+        # skip the points at the new start (a cutoff hit by a force split, duplicates)
+        while running_idx + 1 < n_points and points[running_idx + 1] <= start_point:
+            running_idx += 1
+
+    if len(segments) == 0:
+        return [[0.0, float(audio_duration)]]
+
+    # [a] extending to the end of the audio track: a short last segment is merged into the previous one
+    if len(segments) > 1 and segments[-1][1] - segments[-1][0] < min_tail:
+        last_segment = segments.pop()
+        segments[-1][1] = last_segment[1]
+
+    return segments
+
+
 # RUN
 # segments = segment_audio(audio_fn='audio_1.wav', audio_dir='./audio_wav')
 # for segment in segments:
 #     print(segment)
 
+
+def slice_segments(x, fs, segments):
+    """
+    Slice the per-segment signals out of the decoded audio track.
+
+    Input:
+      x, fs:     audio track (as `numpy` array) and its sampling rate
+      segments:  segments of the form [[a0, b0], [a1, b1], ...] (in seconds)
+    Output:
+      a list of signals, one per segment (views of `x`, no copies)
+    """
+    return [x[int(round(start * fs)):int(round(end * fs))] for start, end in segments]
+
+##########################
+# STREAMING SEGMENTATION #
+##########################
+
+class StreamingSegmenter(object):
+    """
+    Online version of `segment_audio` for live lecture ingestion: audio is fed in blocks (as it is
+    recorded) and each segment is returned as soon as it is closed, so that feature extraction and
+    classification can start on early segments while later ones are still being recorded.
+
+    The limits that `silenceRemoval` computes over the whole track are detected incrementally, with
+    the same `st_win`/`st_step` frames: the short-term log energy is smoothed over `smooth_window`
+    seconds and compared to an adaptive threshold, placed at `weight` between the mean of the lowest
+    and the mean of the highest 10% of the frames of the last `history` seconds. As in
+    `segment_audio`, the cutoffs are the middle points of these limits and segments are cut at the
+    last cutoff less than `up_bound` seconds after their start (force-split without any cutoff).
+
+    Differences to `segment_audio`: the threshold only depends on the audio seen so far, and a short
+    last segment is merged into the previous one only if that one has not been emitted yet.
+
+    Input:
+      fs:               sampling rate of the fed audio
+      st_win, st_step:  short term window and step
+      up_bound:         upper bound on the duration of segments (in seconds)
+      smooth_window:    smoothing window of the energy (in seconds)
+      weight:           threshold position between the low and high energy levels
+      history:          duration of the audio the threshold is computed on (in seconds)
+      min_duration:     limits shorter than this are ignored (in seconds)
+    """
+
+    def __init__(self, fs=16000, st_win=0.05, st_step=0.05, up_bound=20,
+                 smooth_window=0.5, weight=0.5, history=60.0, min_duration=0.2):
+        self.fs = fs
+        self.st_step = st_step
+        self.up_bound = up_bound
+        self.weight = weight
+        self.min_duration = min_duration
+        self.win = int(round(st_win * fs))
+        self.step = int(round(st_step * fs))
+
+        self.buffer = np.zeros(0)       # samples not yet covered by a full frame
+        self.n_samples = 0              # samples fed so far
+        self.n_frames = 0               # frames processed so far
+        self.energies = collections.deque(maxlen=max(1, int(history / st_step)))
+        self.smoothing = collections.deque(maxlen=max(1, int(round(smooth_window / st_step))))
+        self.limit_start = None         # start of the limit currently open
+        self.cutoffs = []               # cutoffs after the start of the open segment
+        self.start_point = 0.0          # start of the open segment
+        self.n_segments = 0             # segments emitted so far
+
+    def feed(self, samples):
+        """
+        Input:
+          samples:  the next block of audio (int16 PCM or float samples, mono)
+        Output:
+          the segments closed by this block, of the form [[a0, b0], ...]
+        """
+        samples = np.asarray(samples)
+        if samples.dtype == np.int16:
+            samples = samples / 32768.0
+        self.n_samples += len(samples)
+        self.buffer = np.concatenate((self.buffer, samples))
+        if len(self.buffer) < self.win:
+            return []
+
+        # short-term energies of all the full frames of the block (running sums of squares)
+        n_frames = (len(self.buffer) - self.win) // self.step + 1
+        squares = np.concatenate(([0.0], np.cumsum(self.buffer ** 2)))
+        starts = np.arange(n_frames) * self.step
+        energies = np.log10((squares[starts + self.win] - squares[starts]) / self.win + 1e-10)
+        self.buffer = self.buffer[n_frames * self.step:]
+
+        # adaptive threshold between the low and the high energy levels of the recent audio
+        self.energies.extend(energies)
+        history = np.sort(np.fromiter(self.energies, dtype=float))
+        n_tail = max(1, len(history) // 10)
+        low, high = history[:n_tail].mean(), history[-n_tail:].mean()
+        threshold = low + self.weight * (high - low)
+
+        for energy in energies:
+            self.smoothing.append(energy)
+            now = self.n_frames * self.st_step
+            self.n_frames += 1
+            active = high > low and sum(self.smoothing) / len(self.smoothing) > threshold
+            if active and self.limit_start is None:
+                self.limit_start = now
+            elif not active and self.limit_start is not None:
+                self.close_limit(now)
+
+        return self.close_segments(self.n_frames * self.st_step)
+
+    def close_limit(self, now):
+        if now - self.limit_start >= self.min_duration:
+            self.cutoffs.append(self.limit_start + 0.5 * (now - self.limit_start))
+        self.limit_start = None
+
+    def close_segments(self, now):
+        segments = []
+        while True:
+            end_bound = self.start_point + self.up_bound
+            # cutoffs before `end_bound` may still come from the open limit (or from later audio)
+            if now < end_bound:
+                break
+            if self.limit_start is not None and self.limit_start + 0.5 * (now - self.limit_start) < end_bound:
+                break
+            candidates = [cutoff for cutoff in self.cutoffs if cutoff - self.start_point < self.up_bound]
+            end_point = candidates[-1] if candidates else end_bound
+            segments.append(self.emit(self.start_point, end_point))
+            self.start_point = end_point
+            self.cutoffs = [cutoff for cutoff in self.cutoffs if cutoff > end_point]
+        return segments
+
+    def emit(self, start_point, end_point):
+        # [b] increment the start point of each segment (except the first one) by 0.01, as `segment_audio`
+        segment = [start_point + (0.01 if self.n_segments > 0 else 0.0), float(end_point)]
+        self.n_segments += 1
+        return segment
+
+    def flush(self):
+        """
+        Closes the stream (end of the recording).
+
+        Output:
+          the remaining segments, up to the end of the fed audio
+        """
+        duration = float(self.n_samples) / self.fs
+        if self.limit_start is not None:
+            self.close_limit(self.n_frames * self.st_step)
+        if duration <= self.start_point:
+            return []
+        remaining = cutoffs2segments([cutoff - self.start_point for cutoff in self.cutoffs],
+                                     duration - self.start_point, up_bound=self.up_bound)
+        self.cutoffs = []
+        segments = [self.emit(self.start_point + start, self.start_point + end) for start, end in remaining]
+        self.start_point = duration
+        return segments
+
+
+def stream_segments(x, fs, st_win=0.05, st_step=0.05, up_bound=20, block_duration=60.0):
+    """
+    Segment a whole (e.g. memory-mapped) track block by block with `StreamingSegmenter`: only one block
+    of the track is converted to float at a time.
+
+    Input:
+      x, fs:            audio track (samples, or samples x channels) and its sampling rate
+      st_win, st_step:  short term window and step
+      up_bound:         upper bound on the duration of segments (in seconds)
+      block_duration:   duration of the blocks (in seconds)
+    Output:
+      a list of audio segments of the form [[a0, b0], [a1, b1], ...]
+    """
+    segmenter = StreamingSegmenter(fs=fs, st_win=st_win, st_step=st_step, up_bound=up_bound)
+    block_size = int(block_duration * fs)
+    segments = []
+    for start in range(0, len(x), block_size):
+        block = x[start:start + block_size]
+        if block.ndim > 1:
+            # stereo to mono, block by block
+            block = block.mean(axis=1).astype(x.dtype)
+        segments += segmenter.feed(block)
+    return segments + segmenter.flush()
+
+
+def read_blocks(stream, block_size, follow=False, poll=0.5, idle_timeout=10.0):
+    """
+    Read 16-bit PCM samples from a pipe or from a file that is still being written.
+
+    Input:
+      stream:        a binary stream (e.g. the stdout of ffmpeg, or an open file)
+      block_size:    number of samples per block
+      follow:        at the end of the stream, wait for more data (growing file) instead of stopping
+      poll:          waiting time between reads of a growing file (in seconds)
+      idle_timeout:  a growing file that has not grown for this long is considered complete (in seconds)
+    Output:
+      generator of int16 `numpy` arrays
+    """
+    pending = b''
+    idle = 0.0
+    while True:
+        data = stream.read(2 * block_size - len(pending))
+        if not data:
+            if not follow or idle >= idle_timeout:
+                break
+            time.sleep(poll)
+            idle += poll
+            continue
+        idle = 0.0
+        data = pending + data
+        # keep an odd trailing byte for the next read
+        usable = len(data) - len(data) % 2
+        pending = data[usable:]
+        yield np.frombuffer(data[:usable], dtype=np.int16)
+
+
+def segment_stream(source,
+                   fs=16000,
+                   st_win=0.05,
+                   st_step=0.05,
+                   up_bound=20,
+                   block_duration=1.0,
+                   follow=False):
+    """
+    Segment a lecture while it is being recorded; each segment is yielded as soon as it is closed.
+
+    Input:
+      source:           a binary stream of 16-bit mono PCM at `fs` (e.g. a pipe), the path of a
+                        growing raw PCM or WAV file (with `follow`), or any input ffmpeg reads
+                        (file, URL, device), which is decoded to PCM by an ffmpeg pipe
+      fs:               sampling rate
+      st_win, st_step:  short term window and step
+      up_bound:         upper bound on the duration of segments (in seconds)
+      block_duration:   duration of the audio blocks (in seconds)
+      follow:           `source` is a file that is still being written
+    Output:
+      generator of segments [a, b] (in seconds)
+    """
+    segmenter = StreamingSegmenter(fs=fs, st_win=st_win, st_step=st_step, up_bound=up_bound)
+    block_size = int(block_duration * fs)
+
+    process = None
+    if hasattr(source, 'read'):
+        stream = source
+    elif follow:
+        stream = open(source, 'rb')
+        if source.lower().endswith('.wav'):
+            # the recorder may not have written the whole header yet
+            skip_wav_header(stream, follow=True)
+    else:
+        process = subprocess.Popen(['ffmpeg', '-loglevel', 'quiet', '-i', source,
+                                    '-f', 's16le', '-ac', '1', '-ar', str(fs), 'pipe:1'],
+                                   stdout=subprocess.PIPE)
+        stream = process.stdout
+
+    try:
+        for block in read_blocks(stream, block_size, follow=follow):
+            for segment in segmenter.feed(block):
+                yield segment
+        for segment in segmenter.flush():
+            yield segment
+    finally:
+        if process is not None:
+            process.stdout.close()
+            process.wait()
+        elif stream is not source:
+            stream.close()
+
 #######################
 # MEDIUM SEGMENTATION #
 #######################
@@ -103,7 +409,12 @@ def segment_medium(audio_fn,
                    out_dir='./data/target/video',
                    st_win=0.05,
                    st_step=0.05,
-                   up_bound=20):
+                   up_bound=20,
+                   fs=None,
+                   x=None,
+                   single_pass=True,
+                   reencode=False,
+                   low_memory=False):
     """
     Partition a Youtube video into parts of (at most) `up_bound` duration.
     Segments are determined based on the audio track and are stored into folders inside `out_dir`.
@@ -114,12 +425,22 @@ def segment_medium(audio_fn,
      media_dir:       directory of media
      st_win, st_step: short term window and step
      up_bound:        upper bound on segment duration
+     fs, x:           sampling rate and signal of the audio track, if already decoded
+     single_pass:     cut all parts in one ffmpeg run (segment muxer) instead of one ffmpeg run per part;
+                      if that run fails, the parts are cut one by one
+     reencode:        (single pass) re-encode the video with keyframes forced at the segment starts, so that the
+                      parts start exactly there; slow (a full encode of the medium) and the frames and audio
+                      samples differ from the stream-copied parts the shipped features and models come from
+     low_memory:      detect the silences block by block (see `segment_audio`)
     Output:
-     None
+     the audio segments of the form [[a0, b0], [a1, b1], ...], one per part written (and indexed). With stream
+     copy the muxer can only cut at keyframes, so these are the actual times of the parts (read back from the
+     muxer segment list): parts start at the first keyframe after a segment start, and segments sharing a
+     keyframe interval end up in one part.
     """
     # audio segments
     segments = segment_audio(audio_dir=audio_dir, audio_fn=audio_fn,
-                             st_win=st_win, st_step=st_step, up_bound=up_bound)
+                             st_win=st_win, st_step=st_step, up_bound=up_bound, fs=fs, x=x, low_memory=low_memory)
 
     # match medium (video with audio) to audio track
     media_filenames = os.listdir(media_dir)
@@ -135,47 +456,143 @@ def segment_medium(audio_fn,
     dir_ = os.path.join(out_dir, medium_)
     os.makedirs(dir_, mode=0o777, exist_ok=True)
 
+    folder_name = os.path.basename(dir_)
+
+    part_paths = [os.path.join(dir_, 'part_' + str(idx) + '.mp4') for idx in range(len(segments))]
+    todo = list(range(len(segments)))
+
+    if single_pass:
+        # Use ffmpeg's segment muxer: one pass over the medium, cut at every segment start
+        parts = split_medium(medium_path, dir_, [segment[0] for segment in segments[1:]], reencode=reencode)
+        if parts is None:
+            # parts may be partial: cut every part on its own
+            print('WARNING: single-pass segmentation failed, cutting parts one by one')
+        else:
+            # the parts (and their audio segments) are the ones the muxer actually cut
+            audio_duration = float(segments[-1][1])
+            part_paths = [os.path.join(dir_, part) for part, _, _ in parts]
+            segments = [[start, min(end, audio_duration)] for _, start, end in parts]
+            todo = []
+
+    # [Visuals] Progress bar
+    bar = progressbar.ProgressBar(maxval=len(segments), \
+                                  widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
+    bar.start()
+    bar_index = len(segments) - len(todo)
+    bar.update(bar_index)
+
+    # Segment Video (one ffmpeg run per part)
+    for idx in todo:
+        cut_part(medium_path, part_paths[idx], segments[idx])
+
+        # update progress bar index
+        bar_index += 1
+        bar.update(bar_index)
+
+    bar.finish()
+
+    # Only the parts that exist are indexed (the feature extractors open every indexed part)
+    written = []
     with open(media_dir + '/' + 'index.csv', 'w') as csvfile:
         # Write header
         csvfile.write('FILE;SEG\n')
 
-        # [Visuals] Progress bar
-        bar = progressbar.ProgressBar(maxval=len(segments), \
-                                      widgets=[progressbar.Bar('=', '[', ']'), ' ', progressbar.Percentage()])
-        bar.start()
-        bar_index = 0
-
-        # Segment Video
         for idx in range(len(segments)):
-            elapsed = segments[idx][1] - segments[idx][0]
-            start = time.strftime('%H:%M:%S', time.gmtime(segments[idx][0]))
-            duration = time.strftime('%H:%M:%S', time.gmtime(elapsed))
+            if not os.path.isfile(part_paths[idx]) or os.path.getsize(part_paths[idx]) == 0:
+                print('WARNING: SEGMENT SKIPPED (no video part): ' + part_paths[idx])
+                continue
+
+            # Write to index file
+            ff,suf=os.path.basename(part_paths[idx]).split('.')
+            csvfile.write(folder_name +  ';' + ff + '\n')
+            written.append(segments[idx])
 
-            output_name = 'part' + '_' + str(idx) + '.mp4'
-            output = os.path.join(dir_, output_name)
+    return written
 
-            # Use ffmpeg to split video
-            ffmpeg_command = 'ffmpeg -i ' + medium_path + ' -ss ' + start + ' -t ' + duration + ' -c copy ' + output + ' -loglevel quiet'
-            os.system(ffmpeg_command)
 
-            folder_name = os.path.basename(dir_)
+def split_medium(medium_path, out_dir, cut_points, reencode=False):
+    """
+    Cut a medium into parts at the given times with one ffmpeg run (segment muxer).
 
-            # Write to index file
-            ff,suf=output_name.split('.')
-            csvfile.write(folder_name +  ';' + ff + '\n')
+    Input:
+     medium_path:  the medium
+     out_dir:      directory of the parts (part_0.mp4, part_1.mp4, ...)
+     cut_points:   requested cut times (in seconds)
+     reencode:     re-encode the video with keyframes forced at the cut times (exact cuts); otherwise the
+                   streams are copied and each cut happens at the first keyframe after its time
+    Output:
+     the parts written, as (file name, start, end) (in seconds, from the muxer segment list), or None if
+     ffmpeg failed
+    """
+    list_path = os.path.join(out_dir, 'parts.csv')
+    times = ','.join('{0:.3f}'.format(point) for point in cut_points)
+    ffmpeg_command = ['ffmpeg', '-y', '-loglevel', 'quiet', '-i', medium_path, '-map', '0:v:0', '-map', '0:a?']
+    if reencode:
+        ffmpeg_command += ['-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'aac']
+        if times:
+            ffmpeg_command += ['-force_key_frames', times]
+    else:
+        ffmpeg_command += ['-c', 'copy']
+    if times:
+        ffmpeg_command += ['-segment_times', times]
+    ffmpeg_command += ['-f', 'segment', '-segment_list', list_path, '-segment_list_type', 'csv',
+                       '-reset_timestamps', '1', os.path.join(out_dir, 'part_%d.mp4')]
+    returncode = subprocess.call(ffmpeg_command, stdin=subprocess.DEVNULL)
+    if returncode != 0 or not os.path.isfile(list_path):
+        return None
+
+    parts = []
+    with open(list_path) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) < 3:
+                continue
+            part, start, end = fields[0], float(fields[1]), float(fields[2])
+            if os.path.isfile(os.path.join(out_dir, part)) and os.path.getsize(os.path.join(out_dir, part)) > 0:
+                parts.append((part, start, end))
+    os.remove(list_path)
+
+    return parts
+
+
+def cut_part(medium_path, output, segment):
+    """
+    Cut one part of a medium with its own ffmpeg run.
 
-            # update progress bar index
-            bar_index += 1
-            bar.update(bar_index)
+    Input:
+     medium_path:  the medium
+     output:       the part file
+     segment:      the part limits [a, b] (in seconds)
+    Output:
+     the ffmpeg exit code
+    """
+    elapsed = segment[1] - segment[0]
+    start = time.strftime('%H:%M:%S', time.gmtime(segment[0]))
+    duration = time.strftime('%H:%M:%S', time.gmtime(elapsed))
 
-        bar.finish()
+    # Use ffmpeg to split video
+    ffmpeg_command = ['ffmpeg', '-y', '-i', medium_path, '-ss', start, '-t', duration, '-c', 'copy', output,
+                      '-loglevel', 'quiet']
+    return subprocess.call(ffmpeg_command, stdin=subprocess.DEVNULL)
 
 
 
 # RUN
 # segment_medium(audio_fn='audio_1.wav', audio_dir='./audio_wav', media_dir='./media', out_dir='./segmented')
 
-def input2seg(audio_dir='../data/target/audio/', video_dir='../data/target', output_folder='../data/target/video/'):
+def input2seg(audio_dir='../data/target/audio/', video_dir='../data/target', output_folder='../data/target/video/',
+              reencode=False, low_memory=False):
+    """
+    Segment the target lecture found in `video_dir` (first `.mp4`).
+    The lecture audio is decoded once (one ffmpeg call) and memory-mapped, so the per-segment
+    signals can be sliced from it (as views) instead of being re-extracted from every part.
+    `reencode` (exact cuts, slow) and `low_memory` (block-by-block silence detection) are passed
+    to `segment_medium`.
+
+    Output:
+     a list of per-segment signals (in `index.csv` order), their sampling rate and the
+     lecture as (signal, segments) for whole-lecture feature extraction
+    """
 
     # Clear index file
     index_file = video_dir + '/' + 'index.csv'
@@ -201,6 +618,13 @@ def input2seg(audio_dir='../data/target/audio/', video_dir='../data/target', out
 
     print('Target video segmentation started...')
 
+    signals, fs, lecture = [], None, None
     for filename in os.listdir(audio_dir):
         if filename.endswith(".wav"):
-            segment_medium(audio_fn=filename,audio_dir=audio_dir,media_dir=video_dir,out_dir=output_folder)
+            fs, x = read_audio(os.path.join(audio_dir, filename))
+            segments = segment_medium(audio_fn=filename,audio_dir=audio_dir,media_dir=video_dir,out_dir=output_folder,fs=fs,x=x,
+                                      reencode=reencode, low_memory=low_memory)
+            signals += slice_segments(x, fs, segments)
+            lecture = (x, segments)
+
+    return signals, fs, lecture
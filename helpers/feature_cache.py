@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Content hashes of the files seen in this process, keyed by (path, size, mtime)
+file_hashes = {}
+
+
+def file_hash(path, chunk_size=1 << 20):
+    '''
+    SHA-1 of the content of a file (memoized per process while the file
+    size and modification time stay the same).
+
+    :param path:        the file path
+    :param chunk_size:  read size in bytes
+    :return:            the hex digest
+    '''
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime)
+    if key not in file_hashes:
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(chunk_size), b''):
+                sha.update(block)
+        file_hashes[key] = sha.hexdigest()
+    return file_hashes[key]
+
+
+def array_hash(array):
+    '''
+    SHA-1 of an in-memory signal (dtype, shape and data).
+
+    :param array:   the numpy array
+    :return:        the hex digest
+    '''
+    array = np.ascontiguousarray(array)
+    sha = hashlib.sha1(str(array.dtype).encode() + str(array.shape).encode())
+    # hash the buffer in place (views of memory-mapped signals are not copied)
+    sha.update(memoryview(array.reshape(-1)).cast('B'))
+    return sha.hexdigest()
+
+
+class FeatureCache(object):
+    '''
+    Content-addressed, per-segment feature cache. An entry is keyed by the
+    content hash of the segment source plus the extractor parameters, so
+    that new or changed segments (or a change of frameRate, mt_win, the
+    projection, ...) are extracted again while everything else is reused.
+
+    Entries are stored as .npy files under `cache_dir`. When `max_bytes` is
+    set, the least recently used entries are evicted to stay below it.
+
+    :param cache_dir:   the cache directory
+    :param max_bytes:   maximum total size of the cache (None for unbounded)
+    '''
+
+    def __init__(self, cache_dir='data/cache', max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, source_hash, params):
+        '''
+        Builds the cache key of a segment.
+
+        :param source_hash: content hash of the segment (see file_hash/array_hash)
+        :param params:      dict of extractor parameters
+        :return:            the key
+        '''
+        params = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha1((source_hash + params).encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def get(self, key):
+        '''
+        :param key: the cache key
+        :return:    the cached features or None
+        '''
+        path = self.path(key)
+        try:
+            value = np.load(path)
+        except (IOError, OSError, ValueError):
+            self.misses += 1
+            return None
+        # mark as recently used (for eviction)
+        os.utime(path, None)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''
+        Stores the features of a segment.
+
+        :param key:     the cache key
+        :param value:   the features (numpy array)
+        '''
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(value))
+        os.replace(tmp_path, path)
+
+    def trim(self):
+        '''
+        Applies the size-based eviction (if `max_bytes` is set). Called once
+        at the end of an extraction run.
+        '''
+        if self.max_bytes is not None:
+            return self.evict(self.max_bytes)
+        return 0
+
+    def evict(self, max_bytes):
+        '''
+        Removes the least recently used entries until the cache size is
+        at most `max_bytes`.
+
+        :param max_bytes:   the size limit
+        :return:            the number of removed entries
+        '''
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def report(self, name='features'):
+        print('Feature cache (' + name + '): ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses.')
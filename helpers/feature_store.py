@@ -0,0 +1,294 @@
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+# Store layout (a directory):
+#   schema.json     columns, feature (float) columns, metadata dtypes, rows per chunk, modalities
+#   chunk_<k>.f8    float64 feature block of chunk k, column-major (each column is contiguous)
+#   meta_<k>.csv    metadata (index, FILE, SEG, CLASS_1, ...) of chunk k
+schema_name = 'schema.json'
+
+
+class FeatureStore(object):
+    '''
+    Columnar, memory-mappable storage of a features dataframe, replacing
+    the full-dataframe pickles. The float feature block is stored raw and
+    column-major, so that it is memory-mapped instead of loaded and a
+    subset of columns (e.g. audio only) only reads those columns. The
+    other columns (FILE, SEG, CLASS_1, ...) are kept in a metadata table.
+
+    Rows are appended in chunks (e.g. one per new lecture) without
+    rewriting the existing ones; the row ids (the dataframe index, which
+    merge_features joins on) must be unique in the store.
+
+    :param path:    the store directory
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.schema = None
+        if os.path.exists(os.path.join(path, schema_name)):
+            with open(os.path.join(path, schema_name)) as f:
+                self.schema = json.load(f)
+
+    def exists(self):
+        return self.schema is not None
+
+    @property
+    def columns(self):
+        return self.schema['columns']
+
+    @property
+    def features(self):
+        return self.schema['features']
+
+    @property
+    def n_rows(self):
+        return sum(self.schema['chunks'])
+
+    def write(self, df, modalities=None):
+        '''
+        Replaces the content of the store with the provided dataframe.
+
+        :param df:          the features dataframe (float64 columns are the features)
+        :param modalities:  optional dict of column lists (e.g. {'video': [...], 'audio': [...]})
+                            that can be loaded by name
+        '''
+
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.path)
+
+        features = df.select_dtypes(include=['float64']).columns.to_list()
+        meta = [c for c in df.columns if c not in set(features)]
+        self.schema = {
+            'columns': df.columns.to_list(),
+            'features': features,
+            'meta_dtypes': [[c, str(df[c].dtype)] for c in meta],
+            'modalities': modalities if modalities is not None else {},
+            'chunks': [],
+        }
+        self.append(df)
+
+    def append(self, df):
+        '''
+        Appends the rows of the provided dataframe (same columns as the store)
+        as a new chunk; the store is created if it does not exist. The ids of
+        the new rows must not be in the store already (e.g. the index.csv
+        rows of two different lectures both start at 0): renumber them first.
+
+        :param df:  the features dataframe
+        '''
+
+        if self.schema is None:
+            self.write(df)
+            return
+        if set(df.columns) != set(self.columns):
+            raise ValueError('Columns do not match the schema of "' + self.path + '"')
+        if not df.index.is_unique:
+            raise ValueError('Duplicate row ids in the rows appended to "' + self.path + '"')
+        if self.n_rows > 0:
+            duplicated = df.index.intersection(self.metadata().index)
+            if len(duplicated) > 0:
+                raise ValueError('Row ids already in "' + self.path + '": ' +
+                                 ', '.join(str(i) for i in duplicated[:10]))
+
+        chunk = len(self.schema['chunks'])
+        block = np.asfortranarray(df[self.features].values, dtype='<f8')
+        with open(os.path.join(self.path, 'chunk_' + str(chunk) + '.f8'), 'wb') as f:
+            f.write(block.tobytes(order='F'))
+        df[[c for c, _ in self.schema['meta_dtypes']]].to_csv(
+            os.path.join(self.path, 'meta_' + str(chunk) + '.csv'))
+
+        # the schema is updated last: a failed append leaves the store as it was
+        self.schema['chunks'].append(len(df))
+        self.save_schema()
+
+    def save_schema(self):
+        tmp_path = os.path.join(self.path, schema_name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(self.schema, f)
+        os.replace(tmp_path, os.path.join(self.path, schema_name))
+
+    def holds(self, df):
+        '''
+        :param df:  a features dataframe
+        :return:    True if the store holds exactly the first rows of `df`
+                    (same columns, ids, metadata and feature values)
+        '''
+
+        if self.schema is None or self.columns != df.columns.to_list() or self.n_rows > len(df):
+            return False
+        head = df.iloc[:self.n_rows]
+        meta = self.metadata()
+        return meta.index.equals(head.index) and meta.equals(head[meta.columns]) and \
+            np.array_equal(self.matrix(), head[self.features].values)
+
+    def select(self, columns=None):
+        '''
+        :param columns: list of feature columns, a modality name, or None for all the features
+        :return:        the feature columns to load
+        '''
+
+        if columns is None:
+            return self.features
+        if isinstance(columns, str):
+            if columns not in self.schema['modalities']:
+                raise ValueError('Unknown modality "' + columns + '" in "' + self.path + '"')
+            columns = self.schema['modalities'][columns]
+        missing = [c for c in columns if c not in set(self.features)]
+        if missing:
+            raise ValueError('Missing feature columns: ' + ', '.join(str(c) for c in missing[:10]))
+        return list(columns)
+
+    def matrix(self, columns=None):
+        '''
+        Feature block of the store: a read-only memory map when all the
+        columns of a single chunk are requested, otherwise only the requested
+        columns are read.
+
+        :param columns: see select
+        :return:        (rows x columns) float64 array
+        '''
+
+        columns = self.select(columns)
+        positions = {c: i for i, c in enumerate(self.features)}
+        index = np.array([positions[c] for c in columns], dtype=int)
+        all_columns = len(columns) == len(self.features) and np.all(index == np.arange(len(index)))
+
+        blocks = []
+        for chunk, n_rows in enumerate(self.schema['chunks']):
+            if n_rows == 0:
+                continue
+            block = np.memmap(os.path.join(self.path, 'chunk_' + str(chunk) + '.f8'), dtype='<f8', mode='r',
+                              shape=(n_rows, len(self.features)), order='F')
+            blocks.append(block if all_columns else block[:, index])
+
+        if len(blocks) == 1:
+            return blocks[0]
+        if len(blocks) == 0:
+            return np.empty((0, len(columns)))
+        return np.vstack(blocks)
+
+    def metadata(self):
+        '''
+        :return:    the metadata table (non-feature columns) of all the rows
+        '''
+
+        dtypes = dict((c, t) for c, t in self.schema['meta_dtypes'])
+        parts = [pd.read_csv(os.path.join(self.path, 'meta_' + str(chunk) + '.csv'), index_col=0,
+                             dtype={c: t for c, t in dtypes.items() if t == 'object'})
+                 for chunk in range(len(self.schema['chunks']))]
+        meta = pd.concat(parts) if parts else pd.DataFrame(columns=list(dtypes))
+        meta.columns = list(dtypes)
+        return meta.astype(dtypes)
+
+    def read(self, columns=None):
+        '''
+        Loads the store as a dataframe (metadata and the selected features,
+        in the original column order).
+
+        :param columns: see select
+        :return:        the features dataframe
+        '''
+
+        columns = self.select(columns)
+        meta = self.metadata()
+        data = pd.DataFrame(self.matrix(columns), index=meta.index, columns=columns, copy=False)
+        df = pd.concat([meta, data], axis=1)
+
+        selected = set(columns) | set(meta.columns)
+        return df[[c for c in self.columns if c in selected]]
+
+
+def write_features(df, path, modalities=None):
+    '''
+    Writes a features dataframe as a feature store (replacing its content).
+
+    :param df:          the features dataframe
+    :param path:        the store directory
+    :param modalities:  see FeatureStore.write
+    '''
+    FeatureStore(path).write(df, modalities)
+
+
+def update_features(df, path, modalities=None):
+    '''
+    Writes a features dataframe to a feature store incrementally: when the
+    store already holds the first rows of `df` unchanged (e.g. a lecture was
+    added at the end of index.csv), only the new rows are appended;
+    otherwise the store is rewritten.
+
+    :param df:          the features dataframe
+    :param path:        the store directory
+    :param modalities:  see FeatureStore.write
+    :return:            the number of rows written
+    '''
+    store = FeatureStore(path)
+    if store.holds(df):
+        if len(df) > store.n_rows:
+            n_rows = store.n_rows
+            store.append(df.iloc[n_rows:])
+            return len(df) - n_rows
+        return 0
+    store.write(df, modalities)
+    return len(df)
+
+
+def pickle_path(path):
+    '''
+    :param path:    the store directory (e.g. data/Video2Features.store)
+    :return:        the features pickle written there before the feature store (data/Video2Features.pkl)
+    '''
+    return os.path.splitext(path)[0] + '.pkl'
+
+
+def convert_pickle(path, modalities=None):
+    '''
+    One-time conversion of a features pickle (written before the feature
+    store, see pickle_path) to a feature store. The store records the
+    pickle it comes from.
+
+    :param path:        the store directory
+    :param modalities:  see FeatureStore.write
+    :return:            the feature store
+    '''
+    source = pickle_path(path)
+    store = FeatureStore(path)
+    store.write(pd.read_pickle(source), modalities)
+    store.schema['converted_from'] = os.path.basename(source)
+    store.save_schema()
+    print('Features pickle "' + source + '" converted to the feature store "' + path + '"')
+    return store
+
+
+def from_pickle(path):
+    '''
+    :param path:    the store directory
+    :return:        True if the features of `path` come from a features pickle (converted,
+                    or to be converted by read_features) rather than from an extraction
+    '''
+    store = FeatureStore(path)
+    if store.exists():
+        return 'converted_from' in store.schema
+    return os.path.exists(pickle_path(path))
+
+
+def read_features(path, columns=None):
+    '''
+    Loads a features dataframe from a feature store; a features pickle of an
+    existing data folder (see pickle_path) is converted once if there is no
+    store yet.
+
+    :param path:        the store directory
+    :param columns:     list of feature columns, a modality name, or None for all the features
+    :return:            the features dataframe
+    '''
+    store = FeatureStore(path)
+    if not store.exists():
+        if not os.path.exists(pickle_path(path)):
+            raise IOError('No feature store in "' + path + '"')
+        store = convert_pickle(path)
+    return store.read(columns)
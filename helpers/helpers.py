@@ -1,24 +1,108 @@
+import numpy as np
 import pandas as pd
+from .feature_store import write_features
 
-def merge_features(video_df, audio_df, data_dir='data'):
+def merge_features(video_df, audio_df, data_dir='data', save=True):
     '''
     Merging the video & audio dataframe into one single dataframe to be ready for training.
 
-    :param video_df: the video features dataframe
-    :param audio_df: the audio features dataframe
-    :return: the merged features dataframe
+    Both dataframes are indexed by the segment id assigned when index.csv is
+    loaded (the row of the segment in index.csv), so the join is made on that
+    integer index: the video and audio blocks are copied once, straight into
+    one contiguous float matrix. Feature columns present in both get the
+    '_v' / '_a' suffixes. Segments missing from either side are reported.
+
+    :param video_df:    the video features dataframe
+    :param audio_df:    the audio features dataframe
+    :param data_dir:    the data directory
+    :param save:        save the merged features (Features.store) in `data_dir`
+    :return: the merged features dataframe (indexed by segment id)
     '''
 
-    merge_key = ['FILE', 'SEG', 'CLASS_1']
-    if 'CLASS_1' not in video_df.columns:
-        merge_key = ['FILE', 'SEG']
+    # Segments with both video and audio features (in index.csv order)
+    segments = video_df.index.intersection(audio_df.index).sort_values()
+    report_dropped(video_df, video_df.index.difference(segments), 'video', 'no audio features')
+    report_dropped(audio_df, audio_df.index.difference(segments), 'audio', 'no video features')
+
+    # Both sides must describe the same segments (same index.csv)
+    meta_columns = video_df.select_dtypes(exclude=['float64']).columns.to_list()
+    for column in meta_columns:
+        if column in audio_df.columns and \
+                not (video_df.loc[segments, column].values == audio_df.loc[segments, column].values).all():
+            raise ValueError('Video and audio features disagree on "' + str(column) +
+                             '": they were not extracted from the same index.csv')
+
+    # One contiguous float matrix: video block, then audio block (column-major,
+    # the layout of the dataframe float blocks, so that no copy is needed)
+    modalities = modality_columns(video_df, audio_df)
+    video_columns = video_df.select_dtypes(include=['float64']).columns
+    audio_columns = audio_df.select_dtypes(include=['float64']).columns
+    n_video = len(video_columns)
+    data = np.empty((len(segments), n_video + len(audio_columns)), order='F')
+    take_rows(video_df[video_columns].values, video_df.index.get_indexer(segments), data[:, :n_video])
+    take_rows(audio_df[audio_columns].values, audio_df.index.get_indexer(segments), data[:, n_video:])
 
-    # Merge (join) dataframes
-    df = pd.merge(video_df, audio_df, on=merge_key, how='inner', suffixes=['_v', '_a'])
+    df = pd.concat([video_df.loc[segments, meta_columns],
+                    pd.DataFrame(data, index=segments, columns=modalities['video'] + modalities['audio'], copy=False)],
+                   axis=1, copy=False)
 
-    # Save merged features dataframe
-    df.to_pickle(data_dir + '/' + 'Features.pkl')
+    # Save merged features dataframe (video / audio columns can be loaded separately)
+    if save:
+        write_features(df, data_dir + '/' + 'Features.store', modalities=modalities)
 
     return df
 
 
+def take_rows(block, rows, out):
+    '''
+    Copies the selected rows of a feature block into `out`, one column at a
+    time (columns of the column-major blocks are contiguous).
+
+    :param block:   the (rows x columns) feature block
+    :param rows:    the positions of the rows to copy
+    :param out:     the (len(rows) x columns) output, column-major
+    '''
+
+    if len(rows) == block.shape[0] and (np.diff(rows) == 1).all():
+        # nothing dropped: plain block copy
+        out[...] = block
+        return
+    for column in range(block.shape[1]):
+        np.take(block[:, column], rows, out=out[:, column], mode='clip')
+
+
+def report_dropped(df, dropped, modality, reason):
+    '''
+    Prints the segments of one modality that are left out of the merge.
+
+    :param df:          the features dataframe of the modality
+    :param dropped:     the ids of the dropped segments
+    :param modality:    the modality name
+    :param reason:      why they are dropped
+    '''
+
+    if len(dropped) == 0:
+        return
+    names = [str(f) + '/' + str(s) for f, s in df.loc[dropped, ['FILE', 'SEG']].values]
+    print('Dropped ' + str(len(dropped)) + ' ' + modality + ' segments (' + reason + '): ' + ', '.join(names[:20]) +
+          (' ...' if len(names) > 20 else ''))
+
+
+def modality_columns(video_df, audio_df):
+    '''
+    Names of the video and audio feature columns once the two dataframes
+    are merged (columns present in both get the '_v' / '_a' suffixes).
+
+    :param video_df:    the video features dataframe
+    :param audio_df:    the audio features dataframe
+    :return:            dict with the 'video' and 'audio' column names
+    '''
+
+    video_columns = video_df.select_dtypes(include=['float64']).columns
+    audio_columns = audio_df.select_dtypes(include=['float64']).columns
+    shared = set(video_columns) & set(audio_columns)
+
+    return {
+        'video': [str(c) + '_v' if c in shared else c for c in video_columns],
+        'audio': [str(c) + '_a' if c in shared else c for c in audio_columns],
+    }
@@ -0,0 +1,259 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss_mb(who='self'):
+    '''
+    Peak resident set size over the whole lifetime of this process (or the
+    largest of its finished children, e.g. ffmpeg and pool workers) in MB;
+    None if it cannot be measured. This is a high-water mark: it never
+    goes down, so it cannot tell which stage reached it (see stage_peak_rss_mb).
+
+    :param who: 'self' or 'children'
+    '''
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN)
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    scale = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+    return usage.ru_maxrss / scale
+
+
+def current_rss_mb():
+    '''
+    Current resident set size of this process in MB (Linux only, None elsewhere).
+    '''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.0 / 1024.0
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+def reset_peak_rss():
+    '''
+    Resets the RSS high-water mark of this process (Linux: /proc/self/clear_refs),
+    so that stage_peak_rss_mb measures from now on.
+
+    :return:    True if the high-water mark could be reset
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+
+def stage_peak_rss_mb():
+    '''
+    RSS high-water mark of this process since the last reset_peak_rss (Linux only).
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def children_cpu_time():
+    '''
+    CPU time (user + system) of the terminated and waited-for children of
+    this process (pool workers once joined, ffmpeg runs), in seconds.
+    '''
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def rounded(value, digits=4):
+    return None if value is None else round(value, digits)
+
+
+class RunReport(object):
+    '''
+    Per-run collection of stage measurements: wall time, CPU time (of this
+    process and of its finished children), RSS and items/sec for every
+    stage of the pipeline.
+
+    Limits: the CPU time of child processes (pool workers, ffmpeg) is only
+    counted once they have exited and have been waited for; the per-stage
+    peak RSS needs Linux (elsewhere only the process-lifetime peak is given);
+    stages must not be nested (each one resets the RSS high-water mark).
+
+    :param name:    the run name (e.g. the lecture_classifier action)
+    '''
+
+    def __init__(self, name='run'):
+        self.name = name
+        self.started = time.strftime('%Y-%m-%d %H:%M:%S')
+        self.stages = []
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.children_cpu_start = children_cpu_time()
+
+    @contextmanager
+    def stage(self, name, items=None):
+        '''
+        Measures the enclosed block. The yielded dict can be updated inside
+        the block, e.g. to set the number of processed items.
+
+        :param name:    the stage name
+        :param items:   number of items (segments, frames, rows) processed
+        '''
+        record = {'stage': name, 'items': items}
+        rss_start = current_rss_mb()
+        peak_reset = reset_peak_rss()
+        children_cpu = children_cpu_time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            rss_end = current_rss_mb()
+            self.record(name, wall, cpu, record['items'])
+            self.stages[-1].update({
+                'children_cpu_s': None if children_cpu is None else rounded(children_cpu_time() - children_cpu),
+                'rss_start_mb': rounded(rss_start, 1),
+                'rss_end_mb': rounded(rss_end, 1),
+                'rss_delta_mb': None if rss_start is None or rss_end is None else round(rss_end - rss_start, 1),
+                'stage_peak_rss_mb': rounded(stage_peak_rss_mb(), 1) if peak_reset else None,
+            })
+
+    def record(self, name, wall, cpu=None, items=None, workers=None):
+        '''
+        Adds a stage measured by the caller (e.g. time accumulated inside a
+        loop, or inside pool workers). No RSS is measured for these.
+
+        :param name:    the stage name
+        :param wall:    wall time (s); summed over the workers if `workers` is set
+        :param cpu:     CPU time (s)
+        :param items:   number of items processed
+        :param workers: number of worker processes the times are summed over
+        '''
+        self.stages.append({
+            'stage': name,
+            'wall_s': round(wall, 4),
+            'cpu_s': rounded(cpu),
+            'workers': workers,
+            'items': items,
+            'items_per_s': round(items * (workers or 1) / wall, 3) if items and wall > 0 else None,
+            'process_peak_rss_mb': rounded(peak_rss_mb('self'), 1),
+        })
+
+    def to_dict(self):
+        return {
+            'run': self.name,
+            'started': self.started,
+            'wall_s': round(time.perf_counter() - self.wall_start, 4),
+            'cpu_s': round(time.process_time() - self.cpu_start, 4),
+            'children_cpu_s': None if self.children_cpu_start is None else
+                              rounded(children_cpu_time() - self.children_cpu_start),
+            'process_peak_rss_mb': rounded(peak_rss_mb('self'), 1),
+            'children_peak_rss_mb': rounded(peak_rss_mb('children'), 1),
+            'stages': self.stages,
+        }
+
+    def save(self, filename):
+        '''
+        Writes the report as JSON.
+
+        :param filename:    the output file
+        '''
+        directory = os.path.dirname(filename)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print('Run report saved in "' + filename + '"')
+
+    def summary(self):
+        print('---------------------------')
+        print('    Stage timings          ')
+        print('---------------------------')
+        for s in self.stages:
+            print('{0:24s} wall {1:8.2f} s  cpu {2:>8s} s  children cpu {3:>8s} s  peak RSS {4:>8s} MB  items/s {5:>8s}'.format(
+                s['stage'] + (' (' + str(s['workers']) + ' workers)' if s.get('workers') else ''), s['wall_s'],
+                '-' if s['cpu_s'] is None else '{0:.2f}'.format(s['cpu_s']),
+                '-' if s.get('children_cpu_s') is None else '{0:.2f}'.format(s['children_cpu_s']),
+                '-' if s.get('stage_peak_rss_mb') is None else '{0:.1f}'.format(s['stage_peak_rss_mb']),
+                '-' if s['items_per_s'] is None else '{0:.1f}'.format(s['items_per_s'])))
+
+
+# The report of the current run; stages are recorded only while it is set
+current_report = None
+
+
+def start_run(name='run'):
+    '''
+    Starts a new run report that `stage` and `record` write to.
+
+    :param name:    the run name
+    :return:        the report
+    '''
+    global current_report
+    current_report = RunReport(name)
+    return current_report
+
+
+@contextmanager
+def stage(name, items=None):
+    '''
+    Measures a stage of the current run (a no-op without a run report).
+    '''
+    if current_report is None:
+        yield {'stage': name, 'items': items}
+    else:
+        with current_report.stage(name, items) as record:
+            yield record
+
+
+def record(name, wall, cpu=None, items=None, workers=None):
+    '''
+    Adds a caller-measured stage to the current run (if any).
+    '''
+    if current_report is not None:
+        current_report.record(name, wall, cpu, items, workers)
+
+
+@contextmanager
+def profile(filename=None, top=25):
+    '''
+    Optional cProfile hook: profiles the enclosed block, saves the raw stats
+    (for snakeviz/pstats) and prints the top functions by cumulative time.
+
+    :param filename:    where to dump the stats (None: print only)
+    :param top:         number of functions to print
+    '''
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if filename is not None:
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(filename)
+            print('Profile saved in "' + filename + '"')
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        print(out.getvalue())
@@ -1,13 +1,16 @@
 import argparse
-import os
-import os.path as path
-import pandas as pd
+import time
 import classification.classification as cl
+import classification.tuning as tuning
+import classification.server as srv
 import audio.audio_features as af
 import Video2Features.Video2Features as vf
 import helpers.helpers as helpers
 import Labels2Summary.Labels2Summary as ls
 import helpers.av_segmentation as seg
+from helpers.feature_cache import FeatureCache
+from helpers.feature_store import read_features, from_pickle
+import helpers.instrumentation as instr
 
 
 import matplotlib
@@ -18,8 +21,12 @@ data_path_source = 'data'
 # data_path_target = 'data/target_1m'
 data_path_target = 'data/target_5m'
 
-features_audio_file = 'Audio2Features.pkl'
-features_video_file = 'Video2Features.pkl'
+features_audio_file = 'Audio2Features.store'
+features_video_file = 'Video2Features.store'
+
+# Per-segment feature cache (shared by all runs)
+cache_dir = 'data/cache'
+cache_max_bytes = 1 << 30
 
 def main():
     '''
@@ -30,6 +37,10 @@ def main():
         - Training: Model is trained on the entire dataset and is saved on disk.
         - Target evaluation: The trained model (loaded from disk) is used to evaluate 
          external dataset.
+        - Hyperparameter search: SVM parameters and feature subsets (video, audio, both)
+         are searched with leave-one-video-out cross validation.
+        - Scoring service: the trained model is kept loaded and scores segments sent
+         to a local HTTP server.
     
     Annotated datasets are assumed to be available in 'data' folder.    
     '''
@@ -40,7 +51,15 @@ def main():
 
     # Parser
     parser = argparse.ArgumentParser(description = "Lecture Classifier v0.1")
-    parser.add_argument('-a', choices=['eval_train', 'train', 'eval_target'], required=False, help='Select action. Available: Training evaluation, Model training, Target evaluation', default='eval_train')
+    parser.add_argument('-a', choices=['eval_train', 'train', 'eval_target', 'tune', 'serve'], required=False, help='Select action. Available: Training evaluation, Model training, Target evaluation, Hyperparameter search, Scoring service', default='eval_train')
+    parser.add_argument('-j', type=int, required=False, help='Number of worker processes used for feature extraction and evaluation folds', default=1)
+    parser.add_argument('--reencode', action='store_true', help='Target evaluation: re-encode the video when cutting the parts, so that they start exactly at the segment starts (slow)')
+    parser.add_argument('--low_memory', action='store_true', help='Target evaluation: detect the silences block by block (bounded memory on long lectures; segments differ slightly)')
+    parser.add_argument('--lecture_audio', action='store_true', help='Target evaluation: extract audio features once over the whole lecture and pool them per segment (only for models trained on such features)')
+    parser.add_argument('--n_iter', type=int, required=False, help='Hyperparameter search: number of random candidates (default: full grid)', default=None)
+    parser.add_argument('--port', type=int, required=False, help='Scoring service: port on 127.0.0.1', default=8000)
+    parser.add_argument('--save_features', action='store_true', help='Save the merged features (Features.store) in the data folder')
+    parser.add_argument('--profile', action='store_true', help='Profile the run with cProfile (stats saved next to the run report)')
 
     # Parameters
     args = parser.parse_args()
@@ -54,16 +73,54 @@ def main():
     elif args.a == 'eval_target':
         print("    [TARGET EVALUATION MODE]")
         data_path = data_path_target
+    elif args.a == 'tune':
+        print("    [HYPERPARAMETER SEARCH MODE]")
+        data_path = data_path_source
+    elif args.a == 'serve':
+        print("    [SCORING SERVICE MODE]")
+        data_path = data_path_source
     print("=================================")
 
+    # Scoring service: the model stays resident and serves requests until interrupted
+    if args.a == 'serve':
+        srv.serve(data_dir=data_path, port=args.port)
+        return
+
+
+    # Run the pipeline, measuring every stage (and optionally profiling it)
+    report = instr.start_run(args.a)
+    report_file = data_path + '/reports/' + args.a + '_' + time.strftime('%Y%m%d-%H%M%S')
+    if args.profile:
+        with instr.profile(report_file + '.prof'):
+            run_pipeline(args, data_path)
+    else:
+        run_pipeline(args, data_path)
+    report.summary()
+    report.save(report_file + '.json')
+
+
+def run_pipeline(args, data_path):
+    '''
+    Runs the pipeline stages of the selected action on `data_path`.
+
+    :param args:        the parsed program arguments
+    :param data_path:   the data directory
+    '''
 
     #################################
     # SEGMENTATION - ONLY TARGET    #
     #################################
 
     # Make video segmentation based on silence
+    signals, fs, lecture = None, None, None
+    audio_mode = 'lecture' if args.lecture_audio else 'segment'
     if args.a == 'eval_target':
-        seg.input2seg(audio_dir=data_path + '/audio/', video_dir=data_path, output_folder=data_path + '/video/')
+        # fail before the extraction if the model was trained on other audio features
+        cl.check_audio_mode(data_path, audio_mode)
+        with instr.stage('segmentation') as stage:
+            signals, fs, lecture = seg.input2seg(audio_dir=data_path + '/audio/', video_dir=data_path, output_folder=data_path + '/video/',
+                                                 reencode=args.reencode, low_memory=args.low_memory)
+            stage['items'] = len(signals)
         print('Target video segmentation is complete.')
 
 
@@ -71,20 +128,40 @@ def main():
     # FEATURE EXTRACTION            #
     #################################
 
-    # Extract video features (if not already extracted)
-    if not path.exists(data_path + '/' + features_video_file):
-        vf.Video2feature(pathIn=data_path+'/', frameRate=4, save=True, trainmode=False)
-    video_df = pd.read_pickle(data_path + '/' + features_video_file)
+    # Existing data folders only have the features pickles (Video2Features.pkl, Audio2Features.pkl):
+    # they are converted once to feature stores and used as they are, as before (delete the .pkl
+    # and .store to extract again). The target lecture is segmented again, so it is always extracted.
+    use_pickles = args.a != 'eval_target'
+
+    # Extract video features (only new or changed segments are extracted, the rest come from the cache)
+    with instr.stage('video features') as stage:
+        if not (use_pickles and from_pickle(data_path + '/' + features_video_file)):
+            vf.Video2feature(pathIn=data_path+'/', frameRate=4, save=True, trainmode=False, n_jobs=args.j,
+                             cache=FeatureCache(cache_dir, cache_max_bytes))
+        video_df = read_features(data_path + '/' + features_video_file)
+        stage['items'] = len(video_df)
     print('Video features loaded.')
 
-    # Extract audio features (if not already extracted)
-    if not path.exists(data_path + '/' + features_audio_file):
-        af.audio_features_extraction(dir_name=data_path, features_audio_file=features_audio_file)
-    audio_df = pd.read_pickle(data_path + '/' + features_audio_file)
+    # Projection the video features were extracted with (features saved before it was
+    # recorded are assumed to use the current one): saved with the trained model and
+    # checked against the model's by load_model
+    projection = vf.read_projection(data_path + '/') or vf.projection_version(trainmode=False)
+
+    # Extract audio features (only new or changed segments are extracted, the rest come from the cache)
+    if not args.lecture_audio:
+        lecture = None
+    with instr.stage('audio features') as stage:
+        if not (use_pickles and from_pickle(data_path + '/' + features_audio_file)):
+            af.audio_features_extraction(dir_name=data_path, features_audio_file=features_audio_file, signals=signals, fs=fs,
+                                         cache=FeatureCache(cache_dir, cache_max_bytes), n_jobs=args.j, lecture=lecture)
+        audio_df = read_features(data_path + '/' + features_audio_file)
+        stage['items'] = len(audio_df)
     print('Audio features loaded.')
 
     # Combine features
-    df = helpers.merge_features(video_df, audio_df, data_path)
+    with instr.stage('merging') as stage:
+        df = helpers.merge_features(video_df, audio_df, data_path, save=args.save_features)
+        stage['items'] = len(df)
     print('Video and audio features merged successfully.')
 
 
@@ -95,14 +172,21 @@ def main():
     # Train or evaluate model
     if args.a == 'eval_train':
         print('Evaluation started.')
-        acc = cl.evaluate_training(df)
+        with instr.stage('training evaluation', len(df)):
+            acc = cl.evaluate_training(df, n_jobs=args.j)
         print('Evaluation completed.')
     elif args.a == 'train':
-        cl.train(df)
+        with instr.stage('training', len(df)):
+            cl.train(df, projection=projection)
     elif args.a == 'eval_target':
-        fit_model = cl.load_model(data_path)
-        final_df = cl.evaluate_target(fit_model, df)
+        with instr.stage('prediction', len(df)):
+            fit_model = cl.load_model(data_path, projection=projection, audio_mode=audio_mode)
+            final_df = cl.evaluate_target(fit_model, df, cl.load_preprocessor(data_path))
         print('Video prediction complete. Summarization process should follow.')
+    elif args.a == 'tune':
+        with instr.stage('tuning', len(df)):
+            tuning.tune(df, modalities=helpers.modality_columns(video_df, audio_df), n_iter=args.n_iter,
+                        n_jobs=args.j, data_dir=data_path)
 
 
     #################################
@@ -120,7 +204,8 @@ def main():
 
     # Make the summarisation video
     if args.a == 'eval_target':
-        ls.df2summary(df=final_df, folderDATA=data_path+'/' ,col_cl='CLASS_1', label=['boring','interesting','neutral'], prc_l=[0.30,0.34,0.36], col_d='DURATION', duration_sec=90, output_folder=data_path, output_name='summary.mp4')
+        with instr.stage('summary rendering'):
+            ls.df2summary(df=final_df, folderDATA=data_path+'/' ,col_cl='CLASS_1', label=['boring','interesting','neutral'], prc_l=[0.30,0.34,0.36], col_d='DURATION', duration_sec=90, output_folder=data_path, output_name='summary.mp4')
 
 
 
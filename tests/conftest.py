@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules are imported from the repository root, as in lecture_classifier.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
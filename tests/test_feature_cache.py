@@ -0,0 +1,77 @@
+import os
+
+import numpy as np
+
+import helpers.feature_cache as feature_cache
+from helpers.feature_cache import FeatureCache, file_hash, array_hash
+
+
+def test_file_hash_follows_content(tmpdir):
+    path = tmpdir.join('part_0.mp4')
+    path.write_binary(b'frames')
+    first = file_hash(str(path))
+    assert file_hash(str(tmpdir.join('.', 'part_0.mp4'))) == first
+    assert (os.path.realpath(str(path)), 6) in [key[:2] for key in feature_cache.file_hashes]
+
+    # a rewritten file (new size / mtime) is hashed again
+    path.write_binary(b'other frames')
+    os.utime(str(path), (1, 1))
+    assert file_hash(str(path)) != first
+
+    copy = tmpdir.join('copy.mp4')
+    copy.write_binary(b'frames')
+    assert file_hash(str(copy)) == first
+
+
+def test_array_hash_of_views_and_memmaps(tmpdir):
+    signal = np.arange(1000, dtype=np.int16)
+    path = str(tmpdir.join('signal.raw'))
+    signal.tofile(path)
+    mapped = np.memmap(path, dtype=np.int16, mode='r')
+
+    assert array_hash(mapped[100:200]) == array_hash(signal[100:200].copy())
+    assert array_hash(signal[::2]) == array_hash(signal[::2].copy())
+    assert array_hash(signal) != array_hash(signal.astype(np.float64))
+    assert array_hash(signal) != array_hash(signal.reshape(10, 100))
+
+
+def test_key_depends_on_source_and_parameters(tmpdir):
+    cache = FeatureCache(str(tmpdir))
+    key = cache.key('abc', {'frameRate': 1, 'projection': 'pca-1'})
+
+    assert cache.key('abc', {'projection': 'pca-1', 'frameRate': 1}) == key
+    assert cache.key('abd', {'frameRate': 1, 'projection': 'pca-1'}) != key
+    assert cache.key('abc', {'frameRate': 2, 'projection': 'pca-1'}) != key
+    assert cache.key('abc', {'frameRate': 1, 'projection': 'pca-2'}) != key
+
+
+def test_get_put_hits_and_misses(tmpdir):
+    cache = FeatureCache(str(tmpdir))
+    key = cache.key('abc', {'frameRate': 1})
+
+    assert cache.get(key) is None
+    features = np.random.RandomState(0).rand(100)
+    cache.put(key, features)
+    np.testing.assert_array_equal(cache.get(key), features)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # no temporary files are left behind
+    assert [name for _, _, files in os.walk(str(tmpdir)) for name in files] == [key + '.npy']
+
+
+def test_evict_least_recently_used(tmpdir):
+    cache = FeatureCache(str(tmpdir), max_bytes=None)
+    keys = [cache.key(str(i), {}) for i in range(4)]
+    for i, key in enumerate(keys):
+        cache.put(key, np.zeros(100))
+        os.utime(cache.path(key), (i, i))
+    # reading an entry marks it as recently used
+    cache.get(keys[0])
+
+    assert cache.trim() == 0
+    entry_size = os.path.getsize(cache.path(keys[0]))
+    assert cache.evict(2 * entry_size) == 2
+    assert [os.path.exists(cache.path(key)) for key in keys] == [True, False, False, True]
+
+    cache.max_bytes = entry_size
+    assert cache.trim() == 1
+    assert [os.path.exists(cache.path(key)) for key in keys] == [True, False, False, False]
@@ -0,0 +1,110 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.feature_store import FeatureStore, write_features, update_features, read_features, from_pickle
+
+
+def features_df(n_rows, first_id=0, lecture='lecture_1', n_features=4, seed=0):
+    rng = np.random.RandomState(seed)
+    ids = pd.RangeIndex(first_id, first_id + n_rows)
+    meta = pd.DataFrame({'FILE': [lecture] * n_rows, 'SEG': ['part_' + str(i) for i in range(n_rows)],
+                         'CLASS_1': ['boring'] * n_rows}, index=ids)
+    data = pd.DataFrame(rng.rand(n_rows, n_features), index=ids)
+    return pd.concat([meta, data], axis=1)
+
+
+def test_write_read_roundtrip(tmpdir):
+    df = features_df(5)
+    path = str(tmpdir.join('Video2Features.store'))
+    write_features(df, path)
+
+    loaded = read_features(path)
+    assert loaded.columns.to_list() == df.columns.to_list()
+    assert (loaded.index == df.index).all()
+    np.testing.assert_array_equal(loaded[[0, 1, 2, 3]].values, df[[0, 1, 2, 3]].values)
+    assert (loaded['SEG'] == df['SEG']).all()
+
+
+def test_matrix_is_memory_mapped_and_columns_selectable(tmpdir):
+    df = features_df(6)
+    path = str(tmpdir.join('Features.store'))
+    write_features(df, path, modalities={'video': [0, 1], 'audio': [2, 3]})
+    store = FeatureStore(path)
+
+    assert isinstance(store.matrix(), np.memmap)
+    np.testing.assert_array_equal(store.matrix('audio'), df[[2, 3]].values)
+    assert read_features(path, 'video').columns.to_list() == ['FILE', 'SEG', 'CLASS_1', 0, 1]
+    with pytest.raises(ValueError):
+        store.select('depth')
+
+
+def test_append_new_ids(tmpdir):
+    path = str(tmpdir.join('Video2Features.store'))
+    first, second = features_df(3), features_df(4, first_id=3, lecture='lecture_2', seed=1)
+    write_features(first, path)
+    FeatureStore(path).append(second)
+
+    loaded = read_features(path)
+    assert loaded.index.to_list() == list(range(7))
+    np.testing.assert_array_equal(loaded[[0, 1, 2, 3]].values, pd.concat([first, second])[[0, 1, 2, 3]].values)
+
+
+def test_append_rejects_duplicate_ids(tmpdir):
+    path = str(tmpdir.join('Video2Features.store'))
+    write_features(features_df(3), path)
+    store = FeatureStore(path)
+
+    # a second lecture with its own index.csv rows (0..k)
+    with pytest.raises(ValueError):
+        store.append(features_df(3, lecture='lecture_2'))
+    assert FeatureStore(path).n_rows == 3
+
+
+def test_append_rejects_other_columns(tmpdir):
+    path = str(tmpdir.join('Video2Features.store'))
+    write_features(features_df(3), path)
+    with pytest.raises(ValueError):
+        FeatureStore(path).append(features_df(2, first_id=3, n_features=5))
+
+
+def test_update_appends_only_new_rows(tmpdir):
+    path = str(tmpdir.join('Video2Features.store'))
+    full = pd.concat([features_df(3), features_df(2, first_id=3, lecture='lecture_2', seed=1)])
+
+    assert update_features(full.iloc[:3], path) == 3
+    assert update_features(full, path) == 2
+    assert FeatureStore(path).schema['chunks'] == [3, 2]
+    assert update_features(full, path) == 0
+
+    # changed features of stored rows: the store is rewritten
+    changed = full.copy()
+    changed.iloc[0, 3] += 1.0
+    assert update_features(changed, path) == 5
+    assert FeatureStore(path).schema['chunks'] == [5]
+    np.testing.assert_array_equal(read_features(path)[[0, 1, 2, 3]].values, changed[[0, 1, 2, 3]].values)
+
+
+def test_pickle_fallback(tmpdir):
+    df = features_df(4)
+    df.to_pickle(str(tmpdir.join('Audio2Features.pkl')))
+    path = str(tmpdir.join('Audio2Features.store'))
+
+    assert from_pickle(path)
+    loaded = read_features(path)
+    np.testing.assert_array_equal(loaded[[0, 1, 2, 3]].values, df[[0, 1, 2, 3]].values)
+    with open(os.path.join(path, 'schema.json')) as f:
+        assert json.load(f)['converted_from'] == 'Audio2Features.pkl'
+    assert from_pickle(path)
+
+    # an extraction replaces the converted store
+    write_features(df, path)
+    assert not from_pickle(path)
+
+
+def test_missing_store(tmpdir):
+    with pytest.raises(IOError):
+        read_features(str(tmpdir.join('Video2Features.store')))
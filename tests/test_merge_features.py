@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from helpers.helpers import merge_features
+from helpers.feature_store import FeatureStore, read_features
+
+
+def segments_df(ids, columns, seed=0):
+    rng = np.random.RandomState(seed)
+    ids = pd.Index(ids)
+    meta = pd.DataFrame({'FILE': ['lecture_1'] * len(ids), 'SEG': ['part_' + str(i) for i in ids],
+                         'CLASS_1': ['boring' if i % 2 else 'interesting' for i in ids]}, index=ids)
+    data = pd.DataFrame(rng.rand(len(ids), len(columns)), index=ids, columns=columns)
+    return pd.concat([meta, data], axis=1)
+
+
+def test_join_on_segment_ids(tmpdir):
+    video_df = segments_df([0, 1, 2, 3], [0, 1, 2])
+    audio_df = segments_df([3, 1, 0, 2], ['energy', 'zcr'], seed=1)
+
+    df = merge_features(video_df, audio_df, data_dir=str(tmpdir), save=False)
+
+    assert df.index.to_list() == [0, 1, 2, 3]
+    assert df.columns.to_list() == ['FILE', 'SEG', 'CLASS_1', 0, 1, 2, 'energy', 'zcr']
+    np.testing.assert_array_equal(df[[0, 1, 2]].values, video_df[[0, 1, 2]].values)
+    np.testing.assert_array_equal(df[['energy', 'zcr']].values, audio_df.loc[[0, 1, 2, 3], ['energy', 'zcr']].values)
+    assert not tmpdir.join('Features.store').exists()
+
+
+def test_segments_missing_from_either_side_are_dropped(tmpdir, capsys):
+    video_df = segments_df([0, 1, 2, 4], [0, 1])
+    audio_df = segments_df([1, 2, 3, 4], ['energy'], seed=1)
+
+    df = merge_features(video_df, audio_df, data_dir=str(tmpdir), save=False)
+
+    assert df.index.to_list() == [1, 2, 4]
+    np.testing.assert_array_equal(df[[0, 1]].values, video_df.loc[[1, 2, 4], [0, 1]].values)
+    np.testing.assert_array_equal(df['energy'].values, audio_df.loc[[1, 2, 4], 'energy'].values)
+    out = capsys.readouterr().out
+    assert 'Dropped 1 video segments (no audio features): lecture_1/part_0' in out
+    assert 'Dropped 1 audio segments (no video features): lecture_1/part_3' in out
+
+
+def test_shared_feature_columns_get_suffixes(tmpdir):
+    video_df = segments_df([0, 1], [0, 1])
+    audio_df = segments_df([0, 1], [1, 2], seed=1)
+
+    df = merge_features(video_df, audio_df, data_dir=str(tmpdir), save=False)
+
+    assert df.columns.to_list() == ['FILE', 'SEG', 'CLASS_1', 0, '1_v', '1_a', 2]
+    np.testing.assert_array_equal(df['1_v'].values, video_df[1].values)
+    np.testing.assert_array_equal(df['1_a'].values, audio_df[1].values)
+
+
+def test_different_index_files_are_rejected(tmpdir):
+    video_df = segments_df([0, 1, 2], [0, 1])
+    audio_df = segments_df([0, 1, 2], ['energy'], seed=1)
+    audio_df.loc[2, 'SEG'] = 'part_7'
+
+    with pytest.raises(ValueError, match='SEG'):
+        merge_features(video_df, audio_df, data_dir=str(tmpdir), save=False)
+
+
+def test_saved_store_keeps_the_modalities(tmpdir):
+    video_df = segments_df([0, 1, 2], [0, 1])
+    audio_df = segments_df([0, 1, 2], ['energy'], seed=1)
+
+    df = merge_features(video_df, audio_df, data_dir=str(tmpdir))
+
+    path = str(tmpdir.join('Features.store'))
+    np.testing.assert_array_equal(FeatureStore(path).matrix('audio'), df[['energy']].values)
+    assert read_features(path, 'video').columns.to_list() == ['FILE', 'SEG', 'CLASS_1', 0, 1]
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+# helpers.av_segmentation imports the silence detection of pyAudioAnalysis
+pytest.importorskip('pyAudioAnalysis')
+from helpers.av_segmentation import cutoffs2segments
+
+
+def check_partition(segments, audio_duration, up_bound=20):
+    assert segments[0][0] == 0.0
+    assert segments[-1][1] == audio_duration
+    assert all(end > start for start, end in segments)
+    assert all(end - start <= up_bound + 1e-9 for start, end in segments[:-1])
+    assert all(a[1] == b[0] for a, b in zip(segments, segments[1:]))
+
+
+@pytest.mark.parametrize('cutoffs, audio_duration, expected', [
+    # cutoffs hit by a force split do not produce zero-length segments
+    ([20.0, 45.0], 70.0, [[0.0, 20.0], [20.0, 40.0], [40.0, 45.0], [45.0, 70.0]]),
+    ([10.0, 30.0, 50.0], 80.0, [[0.0, 10.0], [10.0, 30.0], [30.0, 50.0], [50.0, 70.0], [70.0, 80.0]]),
+    # each segment ends at the last cutoff less than `up_bound` after its start
+    ([5.0, 12.0, 19.0, 26.0, 33.0], 40.0, [[0.0, 19.0], [19.0, 33.0], [33.0, 40.0]]),
+])
+def test_cutoffs2segments(cutoffs, audio_duration, expected):
+    segments = cutoffs2segments(cutoffs, audio_duration)
+    assert segments == expected
+    check_partition(segments, audio_duration)
+
+
+def test_unsorted_duplicate_and_outside_cutoffs():
+    segments = cutoffs2segments([26.0, 12.0, 12.0, -1.0, 0.0, 19.0, 19.0, 45.0], 40.0)
+    assert segments == cutoffs2segments([12.0, 19.0, 26.0], 40.0)
+    check_partition(segments, 40.0)
+
+
+def test_short_tail_is_merged():
+    assert cutoffs2segments([10.0, 18.0], 22.0) == [[0.0, 22.0]]
+    assert cutoffs2segments([10.0, 18.0], 22.0, min_tail=0) == [[0.0, 18.0], [18.0, 22.0]]
+    assert cutoffs2segments([10.0, 18.0], 30.0) == [[0.0, 18.0], [18.0, 30.0]]
+
+
+def test_synthetic_cutoffs_cover_the_track():
+    rng = np.random.RandomState(0)
+    cutoffs = np.cumsum(rng.uniform(0.5, 30, 2000))
+    audio_duration = float(cutoffs[-1] + 3.0)
+    check_partition(cutoffs2segments(cutoffs, audio_duration), audio_duration)
@@ -0,0 +1,136 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from classification.server import serve
+
+
+class StubScorer(object):
+    '''
+    Stands in for LectureScorer: labels a segment after its name, fails on
+    "bad" segments and takes a little time per batch so that the concurrent
+    requests queue up.
+    '''
+
+    batches = []
+
+    def __init__(self, data_dir='data', delay=0.05):
+        self.delay = delay
+        self.closed = False
+
+    def score_batch(self, items):
+        StubScorer.batches.append(len(items))
+        time.sleep(self.delay)
+        results = []
+        for item in items:
+            if item['segment'] == 'bad':
+                results.append(ValueError('No frames to score'))
+            else:
+                results.append(('interesting', {'boring': 0.25, 'interesting': 0.75}))
+        return results
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def service_url():
+    StubScorer.batches = []
+    started = threading.Event()
+    servers = []
+
+    def on_ready(server):
+        servers.append(server)
+        started.set()
+
+    thread = threading.Thread(target=serve, kwargs=dict(port=0, max_batch=8, max_wait=0.05, job_ttl=0.2,
+                                                        scorer_factory=StubScorer, on_ready=on_ready))
+    thread.start()
+    assert started.wait(10)
+    server = servers[0]
+    yield 'http://127.0.0.1:' + str(server.server_address[1])
+    server.shutdown()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    try:
+        with urlopen(Request(url, data=data, headers={'Content-Type': 'application/json'}), timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_concurrent_scores_share_batches(service_url):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        responses = list(pool.map(lambda i: request(service_url + '/score', {'segment': 'part_' + str(i)}), range(16)))
+
+    assert all(code == 200 for code, _ in responses)
+    assert all(body == {'label': 'interesting', 'scores': {'boring': 0.25, 'interesting': 0.75}}
+               for _, body in responses)
+
+    code, metrics = request(service_url + '/metrics')
+    assert code == 200
+    assert metrics['requests'] == 16
+    assert metrics['errors'] == 0
+    assert metrics['batches'] == len(StubScorer.batches) < 16
+    assert metrics['batch_size_max'] > 1
+    assert metrics['queue_depth'] == 0
+
+
+def test_bad_requests(service_url):
+    assert request(service_url + '/score', {'segment': 'bad'}) == (422, {'error': 'No frames to score'})
+    assert request(service_url + '/score', {'video': 'part_0'})[0] == 400
+    assert request(service_url + '/unknown', {'segment': 'part_0'})[0] == 404
+    assert request(service_url + '/unknown')[0] == 404
+
+    code, metrics = request(service_url + '/metrics')
+    assert (metrics['requests'], metrics['errors']) == (1, 1)
+
+
+def test_jobs_are_fetched_once(service_url):
+    code, body = request(service_url + '/jobs', {'segment': 'part_0'})
+    assert code == 202
+    job_url = service_url + '/jobs/' + body['id']
+
+    deadline = time.time() + 10
+    code, body = request(job_url)
+    while body.get('status') == 'pending' and time.time() < deadline:
+        time.sleep(0.01)
+        code, body = request(job_url)
+    assert (code, body['status'], body['label']) == (200, 'done', 'interesting')
+    # finished jobs are forgotten once fetched
+    assert request(job_url)[0] == 404
+
+    code, body = request(service_url + '/jobs', {'segment': 'bad'})
+    job_url = service_url + '/jobs/' + body['id']
+    deadline = time.time() + 10
+    code, body = request(job_url)
+    while body.get('status') == 'pending' and time.time() < deadline:
+        time.sleep(0.01)
+        code, body = request(job_url)
+    assert body == {'status': 'failed', 'error': 'No frames to score'}
+
+
+def test_unfetched_jobs_expire(service_url):
+    ids = [request(service_url + '/jobs', {'segment': 'part_' + str(i)})[1]['id'] for i in range(3)]
+
+    # the jobs finish but are never fetched; after the TTL they are forgotten
+    deadline = time.time() + 10
+    code, metrics = request(service_url + '/metrics')
+    while metrics['expired_jobs'] < 3 and time.time() < deadline:
+        time.sleep(0.05)
+        # expiry runs on job submission and lookup
+        request(service_url + '/jobs/unknown')
+        code, metrics = request(service_url + '/metrics')
+
+    assert metrics['expired_jobs'] == 3
+    assert metrics['stored_jobs'] == 0
+    assert all(request(service_url + '/jobs/' + job_id)[0] == 404 for job_id in ids)